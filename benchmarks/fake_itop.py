@@ -0,0 +1,386 @@
+"""Local stand-in for the iTop REST API (`webservices/rest.php`).
+
+Implements `list_operations`, `core/get` (with `limit` / `page`), `core/create`,
+`core/update` and `core/apply_stimulus` over an in-memory store populated with
+generated `Incident`, `Organization` and `Person` objects. Search keys may be
+object IDs, `dict` selectors or a subset of OQL (`SELECT <class> [WHERE ...]`
+with `=`, `!=`, `<`, `<=`, `>`, `>=`, `LIKE`, `IN`, `AND`, `OR` and parentheses).
+
+Besides the generated incidents, `--titled` incidents belong to the 'EXC'
+organization and are titled 'SOC-EXC-SIEM-<n>' (the titles recognized by
+`incident-siem-exists --inc/--incs`), and `--churn` incidents per second are
+updated in background (status and `last_update`, for the mirror and watch scenarios).
+
+Usage: python benchmarks/fake_itop.py [--port N] [--incidents N] [--latency S] [--churn N] ...
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+try:
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+except Exception:
+    from http.server import HTTPServer as ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+
+# =============================================================================
+# OQL subset
+# =============================================================================
+
+TOKENS = re.compile(r"\s*(?:(?P<string>'(?:\\.|[^'\\])*')|(?P<number>-?\d+(?:\.\d+)?)|(?P<op>>=|<=|!=|=|<|>|\(|\)|,)|(?P<word>[A-Za-z_][A-Za-z0-9_]*))")
+
+
+def tokenize(query):
+    tokens, pos = [], 0
+    query = query.strip()
+    while pos < len(query):
+        match = TOKENS.match(query, pos)
+        if match is None or match.end() == pos:
+            raise Exception("OQL syntax error at offset {0}".format(pos))
+        pos = match.end()
+        if match.group("string") is not None:
+            tokens.append(("value", re.sub(r"\\(.)", r"\1", match.group("string")[1:-1])))
+        elif match.group("number") is not None:
+            tokens.append(("value", json.loads(match.group("number"))))
+        elif match.group("op") is not None:
+            tokens.append(("op", match.group("op")))
+        else:
+            word = match.group("word")
+            tokens.append(word.upper() in ["SELECT", "WHERE", "AND", "OR", "IN", "LIKE", "NOT"] and ("kw", word.upper()) or ("name", word))
+    return tokens
+
+
+class OQL(object):
+    """Minimal OQL parser, compiling `SELECT <class> [WHERE <condition>]` to a predicate.
+    """
+
+    def __init__(self, query):
+        self.tokens = tokenize(query)
+        self.pos = 0
+        self.expect("kw", "SELECT")
+        self.iclass = self.expect("name")[1]
+        self.predicate = lambda fields: True
+        if self.peek() == ("kw", "WHERE"):
+            self.pos += 1
+            self.predicate = self.disjunction()
+        if self.pos != len(self.tokens):
+            raise Exception("OQL syntax error: unexpected '{0}'".format(self.tokens[self.pos][1]))
+
+    def peek(self):
+        return self.pos < len(self.tokens) and self.tokens[self.pos] or (None, None)
+
+    def expect(self, kind, value=None):
+        token = self.peek()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise Exception("OQL syntax error: expected {0} '{1}', got '{2}'".format(kind, value, token[1]))
+        self.pos += 1
+        return token
+
+    def disjunction(self):
+        terms = [self.conjunction()]
+        while self.peek() == ("kw", "OR"):
+            self.pos += 1
+            terms.append(self.conjunction())
+        return lambda fields: any(t(fields) for t in terms)
+
+    def conjunction(self):
+        terms = [self.condition()]
+        while self.peek() == ("kw", "AND"):
+            self.pos += 1
+            terms.append(self.condition())
+        return lambda fields: all(t(fields) for t in terms)
+
+    def condition(self):
+        if self.peek() == ("op", "("):
+            self.pos += 1
+            predicate = self.disjunction()
+            self.expect("op", ")")
+            return predicate
+        name = self.expect("name")[1]
+        kind, op = self.peek()
+        self.pos += 1
+        if (kind, op) == ("kw", "IN"):
+            self.expect("op", "(")
+            values = [self.expect("value")[1]]
+            while self.peek() == ("op", ","):
+                self.pos += 1
+                values.append(self.expect("value")[1])
+            self.expect("op", ")")
+            values = set([str(v) for v in values])
+            return lambda fields: str(fields.get(name)) in values
+        value = self.expect("value")[1]
+        if (kind, op) == ("kw", "LIKE"):
+            pattern = re.compile("^" + re.escape(str(value)).replace("%", ".*").replace("_", ".") + "$")
+            return lambda fields: pattern.match(str(fields.get(name, ""))) is not None
+        compare = {
+            "=": lambda a, b: a == b, "!=": lambda a, b: a != b,
+            "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+            ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+        }.get(op)
+        if kind != "op" or compare is None:
+            raise Exception("OQL syntax error: unsupported operator '{0}'".format(op))
+
+        def predicate(fields):
+            current = fields.get(name)
+            if isinstance(value, (int, float)) and not isinstance(current, (int, float)):
+                try:
+                    current = float(current)
+                except Exception:
+                    return False
+            elif isinstance(value, str):
+                current = str(current)
+            return compare(current, value)
+
+        return predicate
+
+
+# =============================================================================
+# Store
+# =============================================================================
+
+def now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Store(object):
+    """In-memory iTop objects store.
+    """
+
+    def __init__(self, incidents=1000, organizations=50, persons=200, description_size=512, log_entries=3, titled=100, seed=1):
+        self.lock = threading.Lock()
+        self.objects = {"Incident": {}, "Organization": {}, "Person": {}}
+        self.next_id = {"Incident": 1, "Organization": 1, "Person": 1}
+        rnd = random.Random(seed)
+        for i in range(organizations):
+            self.add("Organization", {"name": "Organization {0:03d}".format(i), "code": "O{0:03d}".format(i)})
+        for i in range(persons):
+            self.add("Person", {"first_name": "First{0}".format(i), "name": "Name{0}".format(i),
+                                "email": "person{0}@example.com".format(i), "org_id": rnd.randint(1, max(1, organizations))})
+        for i in range(incidents):
+            org_id = rnd.randint(1, max(1, organizations))
+            self.add("Incident", {"title": "SOC-O{0:03d}-SIEM-{1:05d}".format(org_id - 1, i),
+                                  "org_id": org_id,
+                                  "service_name": "CSOC - Security Monitoring",
+                                  "urgency": rnd.randint(1, 4),
+                                  "status": rnd.choice(["new", "pending", "resolved"]),
+                                  "description": "x" * description_size,
+                                  "public_log": "\n".join(["Alert {0} on host {1}".format(j, rnd.randint(1, 255)) for j in range(log_entries)])})
+        if titled > 0:
+            exc = self.add("Organization", {"name": "Excellium", "code": "EXC"})
+            for i in range(titled):
+                self.add("Incident", {"title": "SOC-EXC-SIEM-{0:05d}".format(i),
+                                      "org_id": exc["id"],
+                                      "service_name": "CSOC - Security Monitoring",
+                                      "urgency": 3,
+                                      "status": "pending",
+                                      "description": "x" * description_size,
+                                      "public_log": "Alert 0 on host 1"})
+        self.random = rnd
+
+    def churn(self, count=1):
+        """Update random incidents (status and last update).
+        """
+        with self.lock:
+            ids = list(self.objects["Incident"].keys())
+            for _ in range(count):
+                obj = self.objects["Incident"][self.random.choice(ids)]
+                self.write("Incident", obj, {"status": self.random.choice(["new", "pending", "resolved"])})
+
+    def add(self, iclass, fields):
+        oid = self.next_id[iclass]
+        self.next_id[iclass] += 1
+        obj = {"id": oid}
+        self.objects[iclass][oid] = obj
+        self.write(iclass, obj, fields)
+        return obj
+
+    def write(self, iclass, obj, fields):
+        for name, value in fields.items():
+            if name == "service_id" and isinstance(value, dict):
+                # Service given by a search structure: only its name is kept.
+                obj["service_name"] = value.get("name")
+            if isinstance(value, dict):
+                # External key given by a search structure.
+                target = {"org_id": "Organization"}.get(name)
+                matches = target is not None and self.search(target, value) or []
+                value = len(matches) > 0 and matches[0]["id"] or 0
+            if name == "public_log":
+                entries = obj.get("public_log", {"entries": []})["entries"]
+                if len(str(value)) > 0:
+                    entries.insert(0, {"date": now(), "user_login": "fake", "message": str(value), "message_html": "<p>{0}</p>".format(str(value).replace("\n", "</p><p>"))})
+                value = {"entries": entries}
+            obj[name] = value
+        # Computed fields.
+        if iclass == "Incident":
+            obj["friendlyname"] = "I-{0:06d}".format(obj["id"])
+            obj["ref"] = obj["friendlyname"]
+            obj["operational_status"] = {"resolved": "resolved", "closed": "closed"}.get(obj.get("status"), "ongoing")
+            org = self.objects["Organization"].get(obj.get("org_id"), {})
+            obj["org_id_friendlyname"] = org.get("name", "")
+            obj["last_update"] = now()
+        elif iclass == "Organization":
+            obj["friendlyname"] = obj.get("name")
+        elif iclass == "Person":
+            obj["friendlyname"] = "{0} {1}".format(obj.get("first_name"), obj.get("name"))
+
+    def search(self, iclass, key):
+        objects = self.objects.get(iclass)
+        if objects is None:
+            raise Exception("Unknown class '{0}'".format(iclass))
+        if isinstance(key, int) or (isinstance(key, str) and key.isdigit()):
+            obj = objects.get(int(key))
+            return obj is not None and [obj] or []
+        if isinstance(key, str):
+            oql = OQL(key)
+            return [o for o in objects.values() if oql.predicate(o)]
+        if isinstance(key, dict):
+            return [o for o in objects.values() if all(self.match(o, k, v) for k, v in key.items())]
+        raise Exception("Invalid key")
+
+    def match(self, obj, name, value):
+        if isinstance(value, dict):
+            target = {"org_id": "Organization"}.get(name)
+            return target is not None and obj.get(name) in [o["id"] for o in self.search(target, value)]
+        return str(obj.get(name)) == str(value)
+
+
+# =============================================================================
+# REST API
+# =============================================================================
+
+OPERATIONS = ["list_operations", "core/get", "core/create", "core/update", "core/apply_stimulus"]
+
+
+def output(iclass, obj, fields):
+    if fields in [None, "", "*"]:
+        selected = dict([(k, v) for k, v in obj.items()])
+    else:
+        selected = dict([(f.strip(), obj.get(f.strip())) for f in fields.split(",")])
+    return {"code": 0, "message": "", "class": iclass, "key": str(obj["id"]), "fields": selected}
+
+
+def handle(store, query):
+    operation = query.get("operation")
+    if operation == "list_operations":
+        return {"code": 0, "message": "Operations: {0}".format(len(OPERATIONS)), "version": "1.3",
+                "operations": [{"verb": o, "description": o, "extension": "CoreServices"} for o in OPERATIONS]}
+    iclass = query.get("class")
+    with store.lock:
+        if operation == "core/get":
+            found = sorted(store.search(iclass, query.get("key", "SELECT {0}".format(iclass))), key=lambda o: o["id"])
+            if query.get("limit"):
+                start = (int(query.get("page", 1)) - 1) * int(query["limit"])
+                found = found[start:start + int(query["limit"])]
+            objects = dict([("{0}::{1}".format(iclass, o["id"]), output(iclass, o, query.get("output_fields"))) for o in found])
+            return {"objects": len(objects) > 0 and objects or None, "code": 0, "message": "Found: {0}".format(len(objects))}
+        if operation == "core/create":
+            obj = store.add(iclass, query.get("fields", {}))
+            return {"objects": {"{0}::{1}".format(iclass, obj["id"]): output(iclass, obj, query.get("output_fields"))}, "code": 0, "message": "created"}
+        if operation in ["core/update", "core/apply_stimulus"]:
+            found = store.search(iclass, query.get("key"))
+            if len(found) != 1:
+                return {"objects": None, "code": 100, "message": "Error: expected exactly one object, found {0}".format(len(found))}
+            store.write(iclass, found[0], query.get("fields", {}))
+            return {"objects": {"{0}::{1}".format(iclass, found[0]["id"]): output(iclass, found[0], query.get("output_fields"))}, "code": 0, "message": "updated"}
+    return {"objects": None, "code": 1, "message": "Error: unknown operation '{0}'".format(operation)}
+
+
+def make_handler(store, latency=0.0, jitter=0.0):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+            form = parse_qs(body)
+            try:
+                query = json.loads(form.get("json_data", ["{}"])[0])
+                result = handle(store, query)
+            except Exception as error:
+                result = {"objects": None, "code": 100, "message": "Error: {0}".format(str(error))}
+            if latency > 0 or jitter > 0:
+                time.sleep(latency + random.uniform(0, jitter))
+            data = json.dumps(result).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class FakeITop(object):
+    """Fake iTop server, running in a background thread.
+    """
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, churn=0.0, **store_options):
+        self.store = Store(**store_options)
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(self.store, latency, jitter))
+        self.server.daemon_threads = True
+        self.address = "http://127.0.0.1:{0}".format(self.server.server_address[1])
+        self.churn = churn
+        self.thread = None
+
+    def start_churn(self):
+        """Start updating `churn` random incidents per second in background (no-op if disabled).
+        """
+        if self.churn <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(1.0)
+                self.store.churn(int(self.churn))
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.start_churn()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake iTop REST server")
+    parser.add_argument("--port", type=int, default=0, help="Listening port (0 for a random port)")
+    parser.add_argument("--incidents", type=int, default=1000, help="Number of generated incidents")
+    parser.add_argument("--organizations", type=int, default=50, help="Number of generated organizations")
+    parser.add_argument("--persons", type=int, default=200, help="Number of generated persons")
+    parser.add_argument("--description-size", type=int, dest="description_size", default=512, help="Incidents description size, in bytes")
+    parser.add_argument("--log-entries", type=int, dest="log_entries", default=3, help="Incidents public log entries")
+    parser.add_argument("--latency", type=float, default=0.0, help="Injected latency, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Injected latency jitter, in seconds")
+    parser.add_argument("--titled", type=int, default=100, help="Number of 'SOC-EXC-SIEM-<n>' titled incidents")
+    parser.add_argument("--churn", type=int, default=0, help="Number of incidents updated per second")
+    args = parser.parse_args()
+    fake = FakeITop(port=args.port, latency=args.latency, jitter=args.jitter, churn=args.churn,
+                    incidents=args.incidents, organizations=args.organizations, persons=args.persons,
+                    description_size=args.description_size, log_entries=args.log_entries, titled=args.titled)
+    print(fake.address)
+    sys.stdout.flush()
+    fake.start_churn()
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""Benchmark suite, backed by the local fake iTop server (`fake_itop.py`).
+
+Measures throughput, latency percentiles and peak RSS of `ITop.query` (serial,
+thread pool and asyncio modes), of large `core/get` result sets, of every
+factory command and of the CLI cold start. Each scenario runs in its own
+process so that peak RSS figures are not shared.
+
+Usage:
+    python benchmarks/run.py [--requests N] [--incidents N] [--latency S] [--churn N] [--only SUBSTRING]
+                             [--save results.json] [--compare baseline.json [--tolerance 0.25]]
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import resource
+import contextlib
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Factory commands scenarios (`{i}` is replaced by the iteration number).
+COMMANDS = {
+    "cli.core-list": ["core-list", "factories"],
+    "cli.core-get": ["core-get", "incident_siem", "--keys", "friendlyname=I-000001"],
+    "cli.core-create": ["core-create", "incident_siem", "--fields", "title=SOC-BENCH-CORE-{i}", "org_id=1"],
+    "cli.core-update": ["core-update", "incident_siem", "1", "--fields", "status=pending"],
+    "cli.core-metrics": ["core-metrics"],
+    "cli.orgs-get": ["orgs-get"],
+    "cli.incident-siem-get": ["incident-siem-get"],
+    "cli.incident-siem-get-org": ["incident-siem-get", "--org-code", "O001"],
+    "cli.incident-siem-exists": ["incident-siem-exists", "--inc-name", "I-000001"],
+    "cli.incident-siem-publog": ["incident-siem-publog", "--inc-id", "2", "--text", "benchmark log {i}"],
+    "cli.incident-siem-publog-diff": ["incident-siem-publog", "--inc-id", "3", "--diff", "--text", "Alert 0 on host 1\nbenchmark log {i}"],
+    "cli.incident-siem-create-new": ["incident-siem-create", "--org-code", "O001", "--inc-title", "SOC-O001-SIEM-B{i}", "--inc-urgency", "2", "--text", "benchmark",
+                                     "--vars", "source_ip:1.2.3.4", "signatures:sig", "dest_ip:4.3.2.1", "time:now", "username:bench", "case_name:bench"],
+    "cli.incident-siem-create-existing": ["incident-siem-create", "--org-code", "O001", "--inc-title", "SOC-O001-SIEM-EXISTING", "--inc-urgency", "2", "--diff", "--text", "benchmark {i}",
+                                          "--vars", "source_ip:1.2.3.4", "signatures:sig", "dest_ip:4.3.2.1", "time:now", "username:bench", "case_name:bench"],
+    "cli.incident-siem-resolve": ["incident-siem-resolve", "--inc-id", "4", "--text", "resolved {i}"],
+    "cli.incident-siem-bulk": ["incident-siem-bulk", "--input", "{bulk}"],
+    "cli.incident-siem-exists-many": ["incident-siem-exists", "--incs"] + [str(i) for i in range(1, 101)] + ["I-{0:06d}".format(i) for i in range(101, 201)]
+                                     + ["SOC-EXC-SIEM-{0:05d}".format(i) for i in range(100)] + ["I-999999"],
+    # Mirror scenarios (the first iteration takes the full snapshot, the next ones are incremental).
+    "cli.core-sync": ["core-sync"],
+    "cli.incident-siem-watch": ["incident-siem-watch", "--once"],
+}
+
+
+# =============================================================================
+# Workers (run in a dedicated process)
+# =============================================================================
+
+def worker_query_serial(options, itop):
+    from soc.apiclient.itop import GetAction
+    get = GetAction(iclass="Incident", output=["title", "status"])
+    latencies = []
+    for i in range(options.requests):
+        start = time.perf_counter()
+        itop.query(get.prepare(key=(i % options.incidents) + 1).json_data())
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def worker_query_many(options, itop):
+    from soc.apiclient.itop import GetAction
+    get = GetAction(iclass="Incident", output=["title", "status"])
+    payloads = [get.prepare(key=(i % options.incidents) + 1).json_data() for i in range(options.requests)]
+    start = time.perf_counter()
+    results = itop.query_many(payloads, workers=options.workers)
+    elapsed = time.perf_counter() - start
+    errors = [r for r in results if isinstance(r, Exception)]
+    if len(errors) > 0:
+        raise errors[0]
+    # Per-request latencies are not observable from the batch: report the amortized latency.
+    return [elapsed / len(payloads)] * len(payloads)
+
+
+def worker_query_async(options, itop):
+    import asyncio
+    from soc.apiclient.itop import GetAction
+    from soc.apiclient.itop.aio import AsyncITop
+    aitop = AsyncITop(config=options.config, max_concurrency=options.workers)
+    get = GetAction(iclass="Incident", output=["title", "status"], itop=aitop)
+    latencies = []
+
+    async def one(i):
+        start = time.perf_counter()
+        await aitop.query(get.prepare(key=(i % options.incidents) + 1).json_data())
+        latencies.append(time.perf_counter() - start)
+
+    async def run():
+        async with aitop:
+            await asyncio.gather(*[one(i) for i in range(options.requests)])
+
+    asyncio.run(run())
+    return latencies
+
+
+def worker_get_full(options, itop):
+    from soc.apiclient.itop import GetAction
+    start = time.perf_counter()
+    res = itop.query(GetAction(iclass="Incident").json_data())
+    count = len(res.get("objects") or {})
+    return [time.perf_counter() - start], count
+
+
+def worker_get_iter(options, itop):
+    from soc.apiclient.itop import GetAction
+    start = time.perf_counter()
+    count = 0
+    for _ in GetAction(iclass="Incident").iter(page_size=500):
+        count += 1
+    return [time.perf_counter() - start], count
+
+
+def worker_command(options, itop):
+    from soc.apiclient.itop.__main__ import build_parser, logger
+    from soc.apiclient.itop.registry import load_factories
+    logger.setLevel("WARNING")
+    load_factories()
+    parser = build_parser()
+    latencies = []
+    for i in range(options.iterations):
+        argv = [a.format(i=i, bulk=options.bulk) for a in COMMANDS[options.scenario]]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            args = parser.parse_args(argv)
+            try:
+                args.func(args)
+            except SystemExit:
+                pass
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def worker_coldstart(options, itop):
+    latencies = []
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    for _ in range(options.iterations):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "soc.apiclient.itop", "--config", options.config, "incident-siem-exists", "--inc-id", "1"],
+                       env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+WORKERS = {
+    "query.serial": worker_query_serial,
+    "query.many": worker_query_many,
+    "query.async": worker_query_async,
+    "get.full": worker_get_full,
+    "get.iter": worker_get_iter,
+    "cli.coldstart": worker_coldstart,
+}
+
+
+def run_worker(options):
+    """Run a single scenario and print its raw results as JSON.
+    """
+    sys.path.insert(0, ROOT)
+    from soc.apiclient.itop import ITop
+    import logging
+    logging.getLogger("soc.apiclient.itop").setLevel(logging.WARNING)
+    itop = ITop(config=options.config, pool_size=max(10, options.workers))
+    func = WORKERS.get(options.scenario, worker_command)
+    start = time.perf_counter()
+    result = func(options, itop)
+    elapsed = time.perf_counter() - start
+    latencies, objects = isinstance(result, tuple) and result or (result, None)
+    print(json.dumps({"elapsed": elapsed, "latencies": latencies, "objects": objects,
+                      "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+# =============================================================================
+# Harness
+# =============================================================================
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def summarize(raw):
+    latencies = raw["latencies"]
+    return {
+        "ops": len(latencies),
+        "throughput": len(latencies) / raw["elapsed"],
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "peak_rss_mb": raw["peak_rss_kb"] / 1024.0,
+        "objects": raw["objects"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="soc.apiclient.itop benchmark suite")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per 'query.*' scenario")
+    parser.add_argument("--iterations", type=int, default=20, help="Iterations per command scenario")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrency of the concurrent scenarios")
+    parser.add_argument("--incidents", type=int, default=5000, help="Number of incidents served by the fake server")
+    parser.add_argument("--organizations", type=int, default=50, help="Number of organizations served by the fake server")
+    parser.add_argument("--description-size", type=int, dest="description_size", default=2048, help="Incidents description size, in bytes")
+    parser.add_argument("--latency", type=float, default=0.005, help="Latency injected by the fake server, in seconds")
+    parser.add_argument("--churn", type=int, default=20, help="Number of incidents updated per second by the fake server")
+    parser.add_argument("--only", type=str, default=None, help="Only run the scenarios whose name contains the given string")
+    parser.add_argument("--save", type=str, default=None, help="Save the results to a JSON file")
+    parser.add_argument("--compare", type=str, default=None, help="Compare the results with a saved JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Tolerated p50 latency regression (ratio)")
+    # Internal worker arguments.
+    parser.add_argument("--worker", dest="scenario", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--config", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--bulk", type=str, default=None, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    if options.scenario is not None:
+        return run_worker(options)
+
+    # Fake server and client configuration.
+    workdir = tempfile.mkdtemp(prefix="soc_apiclient_itop_bench_")
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_itop.py"),
+                               "--incidents", str(options.incidents), "--organizations", str(options.organizations),
+                               "--description-size", str(options.description_size), "--latency", str(options.latency),
+                               "--churn", str(options.churn)],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        address = server.stdout.readline().strip()
+        config = os.path.join(workdir, "config.json")
+        with open(config, 'w') as fd:
+            json.dump({"address": address, "version": "1.3", "user": "bench", "password": "bench"}, fd)
+        bulk = os.path.join(workdir, "bulk.ndjson")
+        with open(bulk, 'w') as fd:
+            for i in range(200):
+                fd.write(json.dumps({"title": "SOC-O002-SIEM-BULK{0}".format(i % 40), "org_code": "O002", "urgency": 3, "text": "alert {0}".format(i),
+                                     "vars": {"source_ip": "1.2.3.4", "signatures": "sig", "dest_ip": "4.3.2.1", "time": "now", "username": "bench", "case_name": "bench"}}) + "\n")
+        env = dict(os.environ, PYTHONPATH=ROOT, SOC_APICLIENT_ITOP_CACHE=workdir)
+        scenarios = list(WORKERS.keys()) + list(COMMANDS.keys())
+        if options.only is not None:
+            scenarios = [s for s in scenarios if options.only in s]
+        results = {}
+        print("{0:<36} {1:>6} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9}".format("scenario", "ops", "ops/s", "p50 ms", "p95 ms", "p99 ms", "RSS MB"))
+        for scenario in scenarios:
+            command = [sys.executable, os.path.abspath(__file__), "--worker", scenario, "--config", config, "--bulk", bulk,
+                       "--requests", str(options.requests), "--iterations", str(options.iterations),
+                       "--workers", str(options.workers), "--incidents", str(options.incidents)]
+            process = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+            if process.returncode != 0:
+                print("{0:<36} failed: {1}".format(scenario, process.stderr.strip().splitlines()[-1:]))
+                continue
+            results[scenario] = summary = summarize(json.loads(process.stdout.strip().splitlines()[-1]))
+            print("{0:<36} {ops:>6} {throughput:>10.1f} {p50_ms:>9.2f} {p95_ms:>9.2f} {p99_ms:>9.2f} {peak_rss_mb:>9.1f}".format(scenario, **summary))
+    finally:
+        server.terminate()
+        server.wait()
+
+    if options.save is not None:
+        with open(options.save, 'w') as fd:
+            json.dump(results, fd, indent=2)
+    if options.compare is not None:
+        with open(options.compare, 'r') as fd:
+            baseline = json.load(fd)
+        regressions = []
+        for scenario, summary in results.items():
+            if scenario in baseline and summary["p50_ms"] > baseline[scenario]["p50_ms"] * (1 + options.tolerance):
+                regressions.append("{0}: p50 {1:.2f}ms -> {2:.2f}ms".format(scenario, baseline[scenario]["p50_ms"], summary["p50_ms"]))
+        for regression in regressions:
+            print("REGRESSION {0}".format(regression))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
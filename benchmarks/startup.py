@@ -0,0 +1,56 @@
+"""CLI start-up time benchmark.
+
+Measures the wall-clock time of `python -m soc.apiclient.itop --help` and of a
+single command cold start (`core-list factories`, which does not reach iTop).
+
+Usage: python benchmarks/startup.py [--runs N] [--python PATH]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(command, env, runs):
+    """Run a command `runs` times and return its wall-clock durations, in milliseconds.
+    """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="soc.apiclient.itop start-up benchmark")
+    parser.add_argument("--runs", type=int, default=20, help="Runs per scenario")
+    parser.add_argument("--python", type=str, default=sys.executable, help="Python interpreter")
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix="soc_apiclient_itop_bench_")
+    config = os.path.join(workdir, "config.json")
+    with open(config, 'w') as fd:
+        json.dump({"address": "http://127.0.0.1:9", "version": "1.3", "user": "bench", "password": "bench"}, fd)
+    env = dict(os.environ, SOC_APICLIENT_ITOP_CACHE=workdir, PYTHONPATH=ROOT)
+    scenarios = [
+        ("interpreter", [args.python, "-c", "pass"]),
+        ("--help", [args.python, "-m", "soc.apiclient.itop", "--help"]),
+        ("core-list factories", [args.python, "-m", "soc.apiclient.itop", "--config", config, "core-list", "factories"]),
+    ]
+    # Warm-up (builds the factories manifest).
+    measure(scenarios[1][1], env, 1)
+    print("{0:<24} {1:>10} {2:>10} {3:>10}".format("scenario", "min (ms)", "median", "max"))
+    for name, command in scenarios:
+        durations = measure(command, env, args.runs)
+        print("{0:<24} {1:>10.1f} {2:>10.1f} {3:>10.1f}".format(name, min(durations), statistics.median(durations), max(durations)))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,11 @@ setup(name="soc_apiclient_itop",
       description="iTop client API",
       author="Jean-Philippe Clipffel",
       packages=["soc", "soc.apiclient", "soc.apiclient.itop", "soc.apiclient.itop.factories"],
+      py_modules=["soc_apiclient_itop_client"],
       namespace_packages = ["soc", "soc.apiclient", ],
-      entry_points={"console_scripts": ["soc.apiclient.itop=soc.apiclient.itop.__main__:main", ]},
+      entry_points={"console_scripts": ["soc.apiclient.itop=soc.apiclient.itop.__main__:main",
+                                        "soc.apiclient.itop-client=soc_apiclient_itop_client:main", ]},
       install_requires=["requests", "tabulate", "jinja2"],
+      extras_require={"async": ["aiohttp"]},
       include_package_data=True
 )
@@ -1,48 +1,85 @@
+import os
 import sys
+import copy
+import time
 import logging
 try:
     from collections import OrderedDict
 except Exception:
     from ordereddict import OrderedDict
-import requests
 import json
-import jinja2
-import jinja2.meta
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from .streaming import ObjectStream
+from .cache import QueryCache
+from .throttle import IDEMPOTENT_OPERATIONS
+from .metrics import METRICS, labels_of
+from .logs import LazyJson
 
 
+# Heavy dependencies ('requests', 'jinja2', 'smtplib' and 'email') are imported
+# on first use to keep the CLI start-up fast.
+
 # Default iTop object to use for Action instances if no 'itop' argument is given.
 ITOP_INSTANCE = None
 
 # List of loaded factories
 LOADED_FACTORIES = {}
 
+# Local cache directory (organizations snapshot, etc.).
+CACHE_DIR = os.environ.get("SOC_APICLIENT_ITOP_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "soc_apiclient_itop"))
+
+# Named output fields profiles, by class (see `register_profile`).
+FIELD_PROFILES = {}
+
+# Operations returning objects (and thus subject to output fields projection).
+OBJECT_OPERATIONS = ["core/get", "core/create", "core/update", "core/apply_stimulus"]
+
+
+def register_profile(iclass, name, fields):
+    """Register a named output fields profile.
+
+    Arguments:
+        iclass (str): iTop object class name (ex: 'Person').
+        name (str): Profile name (ex: 'minimal', 'table').
+        fields (list of str): Output fields.
+    """
+    FIELD_PROFILES.setdefault(iclass, OrderedDict())[name] = list(fields)
+
+
+def get_profile(iclass, name):
+    """Return the output fields of a named profile.
+
+    Arguments:
+        iclass (str): iTop object class name.
+        name (str): Profile name.
+    """
+    profiles = FIELD_PROFILES.get(iclass, {})
+    if name not in profiles:
+        raise Exception("No such fields profile for class '{0}': '{1}' (available: {2})".format(iclass, name, ", ".join(profiles.keys()) or "none"))
+    return list(profiles[name])
+
 
 def render_template(template, variables={}):
     """Render a Jinja2 template.
 
+    Templates are compiled once per version and cached (see `templates.TemplateCache`).
+
     Arguments:
         template (str): Template path.
         variables (dict, optional): Template arguments.
     """
+    from .templates import get_template_cache
     logger = logging.getLogger("soc.apiclient.itop.render_template")
-    # Load template source.
+    # Load template.
     logger.info("loading template from '{0}'".format(template))
-    with open(template, 'r') as fd:
-        tpl_source = fd.read()
-        # Validate that all variables used in templates are defined.
-        logger.info("validating template")
-        env = jinja2.Environment()
-        ast = env.parse(tpl_source)
-        missing = [v for v in jinja2.meta.find_undeclared_variables(ast) if v not in variables]
-        if len(missing) > 0:
-            raise Exception("Missing template variables: {0}".format(", ".join(missing)))
-        # Render template.
-        logger.info("rendering template")
-        tpl = jinja2.Template(tpl_source)
-        return tpl.render(**variables)
+    tpl, undeclared = get_template_cache().get(template)
+    # Validate that all variables used in templates are defined.
+    logger.info("validating template")
+    missing = [v for v in undeclared if v not in variables]
+    if len(missing) > 0:
+        raise Exception("Missing template variables: {0}".format(", ".join(missing)))
+    # Render template.
+    logger.info("rendering template")
+    return tpl.render(**variables)
 
 
 def parse_vars(vars):
@@ -96,9 +133,43 @@ def keys_to_dict(keys):
     return key
 
 
+def quote(value):
+    """Return an OQL literal.
+    """
+    if isinstance(value, (int, float)):
+        return str(value)
+    elif isinstance(value, str):
+        return "'{0}'".format(value.replace("\\", "\\\\").replace("'", "\\'"))
+    raise Exception("Unsupported OQL value type: {0}".format(type(value)))
+
+
+def oql(iclass, key, condition):
+    """Return an OQL query selecting the objects matched by an action key and an extra condition.
+
+    Arguments:
+        iclass (str): iTop object class name.
+        key (str, dict, optional): Action key (OQL query or fields `dict`).
+        condition (str): Extra OQL condition (ex: "last_update >= '2020-01-01 00:00:00'").
+    """
+    if key is None:
+        return "SELECT {0} WHERE {1}".format(iclass, condition)
+    elif isinstance(key, dict):
+        conditions = ["{0} = {1}".format(k, quote(v)) for k, v in key.items()]
+        return "SELECT {0} WHERE {1}".format(iclass, " AND ".join(conditions + [condition]))
+    elif isinstance(key, str) and key.strip().upper().startswith("SELECT"):
+        where = key.upper().find(" WHERE ")
+        if where < 0:
+            return "{0} WHERE {1}".format(key, condition)
+        return "{0} WHERE ({1}) AND {2}".format(key[:where], key[where + 7:], condition)
+    raise Exception("Cannot build an OQL query from key: {0}".format(key))
+
+
 def notify_mail(subject, payload, recipients=[], cc=[], sender="", server="127.0.0.1", port=25):
     """Send a mail.
     """
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
     logger = logging.getLogger("soc.apiclient.itop.notify_mail")
     # Builds mail.
     logger.info("setting-up mail context (subject='{subject}', sender='{sender}', recipients='{recipients}', cc='{cc}')".format(
@@ -132,7 +203,17 @@ def notify_mail(subject, payload, recipients=[], cc=[], sender="", server="127.0
 
 
 class ITop(object):
-    def __init__(self, config=None, **kwargs):
+    def __init__(self, config=None, pool_size=10, cache_ttl=None, cache_size=256, limiter=None, timeout=None, **kwargs):
+        """Initialize the class instance.
+
+        Arguments:
+            config (str, optional): iTop API configuration file path.
+            pool_size (int, optional): HTTP connection pool size (raised on demand by `query_many`).
+            cache_ttl (int, float, optional): Enable the `core/get` results cache with the given time-to-live, in seconds.
+            cache_size (int, optional): Maximum number of cached results.
+            limiter (object, optional): Adaptive concurrency and rate limiter (`throttle.AdaptiveLimiter`).
+            timeout (int, float, optional): HTTP requests timeout, in seconds.
+        """
         self.logger = logging.getLogger("soc.apiclient.itop.ITop")
         # Extract configuration.
         if config is not None:
@@ -152,28 +233,213 @@ class ITop(object):
         if len(missing) > 0:
             raise Exception("Missing parameters (neither in config nor arguments): {0}".format(", ".join(missing)))
         # Prepare future calls.
+        self.query_url = "{0}/webservices/rest.php?version={1}".format(self.__config["address"], self.__config["version"])
+        self.pool_size = pool_size
+        self.cache = cache_ttl is not None and QueryCache(ttl=cache_ttl, size=cache_size) or None
+        self.limiter = limiter
+        self.timeout = timeout
+        self.setup()
+        setattr(sys.modules[__name__], "ITOP_INSTANCE", self)
+
+    def setup(self):
+        """Setup the HTTP transport used by `query`.
+        """
+        import requests
         self.logger.info("setting-up requests session (warning: SSL warnings disabled !)")
         self.session = requests.Session()
         requests.packages.urllib3.disable_warnings()
-        self.query_url = "{0}/webservices/rest.php?version={1}".format(self.__config["address"], self.__config["version"])
-        setattr(sys.modules[__name__], "ITOP_INSTANCE", self)
+        self.mount_pool(self.pool_size)
+
+    def mount_pool(self, size):
+        """(Re)mount the session HTTP adapter with a connection pool of the given size.
+
+        Arguments:
+            size (int): Maximum number of connections kept in the pool.
+        """
+        import requests.adapters
+        self.logger.info("mounting connection pool (size={0})".format(size))
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool_size = size
+
+    def cache_path(self, name):
+        """Return the path of a local cache file specific to this iTop instance
+        (snapshots taken from an instance must not be used with another one).
+
+        Arguments:
+            name (str): Cache file name (ex: 'organizations.json').
+        """
+        import hashlib
+        return os.path.join(CACHE_DIR, hashlib.sha1(self.query_url.encode("utf-8")).hexdigest()[:16], name)
+
+    def credentials(self):
+        """Return the iTop authentication form fields.
+        """
+        return {
+            "auth_user": self.__config["user"],
+            "auth_pwd": self.__config["password"]
+        }
+
+    def send(self, payload, decode=True):
+        """Send a query payload, through the adaptive limiter if enabled.
+
+        Arguments:
+            payload (dict): iTop query payload.
+            decode (bool, optional): Return the decoded response if `True`, the streamed HTTP response otherwise.
+        """
+        labels = labels_of(payload)
+        self.check_output(payload)
+        data = self.credentials()
+        start = time.perf_counter()
+        data["json_data"] = json.dumps(payload)
+        METRICS.inc("itop_json_encode_seconds_total", labels, time.perf_counter() - start)
+        METRICS.inc("itop_request_bytes_total", labels, len(data["json_data"]))
+
+        def post():
+            # Every attempt is counted (retried and failed ones included).
+            METRICS.inc("itop_requests_total", labels)
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.query_url, verify=False, data=data, stream=not decode, timeout=self.timeout)
+            except Exception:
+                METRICS.inc("itop_request_errors_total", dict(labels, code="exception"))
+                raise
+            METRICS.observe("itop_request_seconds", labels, time.perf_counter() - start)
+            if response.status_code >= 500:
+                METRICS.inc("itop_request_errors_total", dict(labels, code="http_{0}".format(response.status_code)))
+                response.close()
+                raise Exception("iTop HTTP error: {0} {1}".format(response.status_code, response.reason))
+            if decode is True:
+                METRICS.inc("itop_response_bytes_total", labels, len(response.content))
+                start = time.perf_counter()
+                result = response.json()
+                METRICS.inc("itop_json_decode_seconds_total", labels, time.perf_counter() - start)
+                return result
+            return response
+
+        if self.limiter is None:
+            return post()
+        return self.limiter.run(post, idempotent=payload.get("operation", None) in IDEMPOTENT_OPERATIONS)
+
+    def check_output(self, payload):
+        """Report the queries returning all the objects fields (no or '*' output fields).
+
+        Arguments:
+            payload (dict): iTop query payload.
+        """
+        if payload.get("operation", None) in OBJECT_OPERATIONS and payload.get("output_fields", "*").strip() == "*":
+            METRICS.inc("itop_wildcard_queries_total", labels_of(payload))
+            self.logger.warning("wildcard query: all fields requested (operation='{0}', class='{1}'), consider an output fields profile".format(payload.get("operation", None), payload.get("class", None)))
+
+    def account(self, payload, code, objects):
+        """Update the per-operation metrics once a query completed
+        (requests are counted when sent, see `send`).
 
-    def query(self, payload):
+        Arguments:
+            payload (dict): iTop query payload.
+            code (int): iTop response code.
+            objects (int): Number of returned objects.
+        """
+        labels = labels_of(payload)
+        METRICS.inc("itop_response_objects_total", labels, objects)
+        if code != 0:
+            METRICS.inc("itop_request_errors_total", dict(labels, code=str(code)))
+
+    def query(self, payload, cache=True):
+        """Run a query.
+
+        Arguments:
+            payload (dict): iTop query payload.
+            cache (bool, optional): Whether a `core/get` may be served from (and stored in) the results cache, if enabled.
+        """
         try:
+            if self.cache is not None:
+                result = self.cache.lookup(payload, cache)
+                if result is not None:
+                    METRICS.inc("itop_cache_hits_total", labels_of(payload))
+                    self.logger.info("cache hit (operation='{0}', class='{1}')".format(payload.get("operation", None), payload.get("class", None)))
+                    return result
+                generation = self.cache.generation(payload.get("class", None))
             self.logger.info("querying (address='{0}', operation='{1}')".format(self.query_url, payload.get("operation", None)))
-            self.logger.info("payload: {0}".format(json.dumps(payload)))
-            response = self.session.post(self.query_url, verify=False, data={
-                "auth_user": self.__config["user"],
-                "auth_pwd": self.__config["password"],
-                "json_data": json.dumps(payload)
-            })
-            return response.json()
+            self.logger.info("payload: %s", LazyJson(payload), extra=labels_of(payload))
+            try:
+                result = self.send(payload)
+            except Exception:
+                # A failed write may still have been applied: its class is invalidated again.
+                if self.cache is not None:
+                    self.cache.store(payload, None, cache)
+                raise
+            self.account(payload, result.get("code", 0), len(result.get("objects") or {}))
+            if self.cache is not None:
+                self.cache.store(payload, result, cache, generation)
+            return result
         except Exception as error:
             raise
 
+    def query_stream(self, payload, chunk_size=65536):
+        """Run a query and decode its response incrementally.
+
+        Yields the returned objects as `(name, object)` tuples (ex: `("Person::1", {...})`)
+        as soon as they are decoded from the response stream. Raises an `Exception` once
+        the response is consumed if iTop reported an error.
+
+        Arguments:
+            payload (dict): iTop query payload.
+            chunk_size (int, optional): Size of the chunks read from the socket.
+        """
+        self.logger.info("querying (address='{0}', operation='{1}', streamed)".format(self.query_url, payload.get("operation", None)))
+        self.logger.info("payload: %s", LazyJson(payload), extra=labels_of(payload))
+        response = self.send(payload, decode=False)
+        labels = labels_of(payload)
+
+        def chunks():
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                METRICS.inc("itop_response_bytes_total", labels, len(chunk))
+                yield chunk
+
+        try:
+            stream = ObjectStream(chunks())
+            count = 0
+            for name, obj in stream:
+                count += 1
+                yield name, obj
+            self.account(payload, stream.header.get("code", 0), count)
+            if stream.header.get("code", 0) != 0:
+                raise Exception("iTop error (code={0}): {1}".format(stream.header.get("code"), stream.header.get("message")))
+        finally:
+            response.close()
+
+    def query_many(self, payloads, workers=None):
+        """Run several queries in parallel on a thread pool.
+
+        Arguments:
+            payloads (list): `Action` instances or raw iTop payloads (`dict`).
+            workers (int, optional): Number of worker threads (default to the connection pool size).
+
+        Returns the results in input order. A failed item holds the raised
+        `Exception` instance instead of its result.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        workers = workers is not None and workers or self.pool_size
+        if workers > self.pool_size:
+            self.mount_pool(workers)
+        payloads = [isinstance(p, Action) and p.json_data() or p for p in payloads]
+
+        def run(payload):
+            try:
+                return self.query(payload)
+            except Exception as error:
+                self.logger.error("query failed (operation='{0}'): {1}".format(payload.get("operation", None), str(error)))
+                return error
+
+        self.logger.info("running {0} queries (workers={1})".format(len(payloads), workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, payloads))
+
 
 class Action(object):
-    def __init__(self, operation=None, iclass=None, output="*", fields=None, key=None, stimulus=None, itop=None, required=[], calculated=[]):
+    def __init__(self, operation=None, iclass=None, output="*", fields=None, key=None, stimulus=None, limit=None, page=None, itop=None, cache=True, required=[], calculated=[], profile=None):
         """Initialize the clss instance.
 
         Arguments:
@@ -183,18 +449,28 @@ class Action(object):
             fields (dict, optional): iTop object values (used by write operations)
             key (str, int, dict, optional): iTop object key (used by search operations)
             stimulus (str, optional): Stimulus code.
+            limit (int, optional): Maximum number of returned objects (used by search operations)
+            page (int, optional): Page number, starting at 1 (used along with `limit`)
             itop (object, optional): ITop object instance. Default to global instance.
+            cache (bool, optional): Allow results to be served from the ITop results cache, if enabled.
             required (list of tuple of string, optional): Required `key` or `fields` values.
             calculated (list of tuple(str, callable)): Calculated outputs.
+            profile (str, optional): Output fields profile (see `register_profile`), overrides `output`.
         """
         self.logger = logging.getLogger("soc.apiclient.itop.{0}".format(self.__class__.__name__))
+        if profile is not None:
+            output = get_profile(iclass, profile)
         self.operation = operation
         self.iclass = iclass
         self.output = output
-        self.fields = fields
-        self.key = key
+        # Own copies of the `dict` templates (they may be shared by the callers).
+        self.fields = type(fields) in [dict, OrderedDict] and type(fields)(fields) or fields
+        self.key = type(key) in [dict, OrderedDict] and type(key)(key) or key
         self.stimulus = stimulus
+        self.limit = limit
+        self.page = page
         self.itop = itop
+        self.cache = cache
         self.required = required
         self.calculated = calculated
 
@@ -212,6 +488,8 @@ class Action(object):
         # Setup output fields.
         if type(self.output) in [list, set]:
             jsdata["output_fields"] = ", ".join(self.output)
+        elif isinstance(self.output, str):
+            jsdata["output_fields"] = self.output
         # Setup key.
         if self.key is not None:
             if type(self.key) in [dict, OrderedDict]:
@@ -228,7 +506,7 @@ class Action(object):
         # Setup fields.
         if self.fields is not None:
             if self.operation in ["core/create", "core/update", "core/apply_stimulus"]:
-                jsdata["fields"] = self.fields
+                jsdata["fields"] = type(self.fields) in [dict, OrderedDict] and type(self.fields)(self.fields) or self.fields
             else:
                 raise Exception("Cannot include the section [fields] in operation '{0}'".format(self.operation))
         # Setup stimulus
@@ -237,28 +515,86 @@ class Action(object):
                 jsdata["stimulus"] = self.stimulus
             else:
                 raise Exception("Cannot include the field [stimulus] in operation '{0}'".format(self.operation))
+        # Setup pagination.
+        if self.limit is not None:
+            if self.operation in ["core/get"]:
+                jsdata["limit"] = self.limit
+                jsdata["page"] = self.page is not None and self.page or 1
+            else:
+                raise Exception("Cannot include the fields [limit] and [page] in operation '{0}'".format(self.operation))
         # Done.
         return jsdata
 
-    def __call__(self, key=None, fields=None, output=None, stimulus=None):
-        """Excecute the iTop query.
+    def resolve_itop(self):
+        """Return the ITop instance to use (the action's own instance or the global one).
+        """
+        itop = self.itop is not None and self.itop or ITOP_INSTANCE
+        if itop is None:
+            raise Exception("Action and inherited class requires a valid ITop instance")
+        return itop
+
+    def prepare(self, key=None, fields=None, output=None, stimulus=None, profile=None, **attrs):
+        """Return a copy of the action with the run-time overrides applied.
+
+        `dict` overrides are merged into (a copy of) the action's own values;
+        the action itself is left untouched.
 
         Arguments:
             key (str, int, dict, optional): Key attribute override.
             fields (dict, optional): Fields attribute override.
+            output (str, list, optional): Output attribute override.
+            stimulus (str, optional): Stimulus attribute override.
+            profile (str, optional): Output fields profile (used if `output` is not set).
+            attrs (optional): Other attributes overrides (ex: `limit`, `page`).
         """
-        itop = self.itop is not None and itop or ITOP_INSTANCE
-        if itop is None:
-            raise Exception("Action and inherited class requires a valid ITop instance")
-        # Update key and fields at run-time.
+        if output is None and profile is not None:
+            output = get_profile(self.iclass, profile)
+        action = copy.copy(self)
         for arg, attr in [(key, "key"), (fields, "fields"), (output, "output"), (stimulus, "stimulus")]:
             if arg is not None:
-                if type(arg) in [dict, OrderedDict] and type(getattr(self, attr)) in [dict, OrderedDict]:
-                    getattr(self, attr).update(arg)
+                current = getattr(action, attr)
+                if type(arg) in [dict, OrderedDict] and type(current) in [dict, OrderedDict]:
+                    merged = type(current)(current)
+                    merged.update(arg)
+                    setattr(action, attr, merged)
                 else:
-                    setattr(self, attr, arg)
+                    setattr(action, attr, arg)
+        for attr, value in attrs.items():
+            setattr(action, attr, value)
+        return action
+
+    def __call__(self, key=None, fields=None, output=None, stimulus=None, profile=None):
+        """Excecute the iTop query.
+
+        Arguments:
+            key (str, int, dict, optional): Key attribute override.
+            fields (dict, optional): Fields attribute override.
+            output (str, list, optional): Output attribute override.
+            stimulus (str, optional): Stimulus attribute override.
+            profile (str, optional): Output fields profile (used if `output` is not set).
+
+        Overrides only apply to this call: actions are immutable templates and may
+        be shared between threads and asyncio tasks.
+
+        Returns an awaitable when the selected iTop instance is an `AsyncITop`.
+        """
+        itop = self.resolve_itop()
+        start = time.perf_counter()
+        # Build the per-call request (the action itself is never modified).
+        request = self.prepare(key=key, fields=fields, output=output, stimulus=stimulus, profile=profile)
         # Run query.
-        return itop.query(self.json_data())
+        result = itop.query(request.json_data(), cache=self.cache)
+        labels = {"action": self.__class__.__name__, "operation": self.operation, "class": self.iclass}
+        if hasattr(result, "__await__"):
+
+            async def timed():
+                value = await result
+                METRICS.observe("itop_action_seconds", labels, time.perf_counter() - start)
+                return value
+
+            return timed()
+        METRICS.observe("itop_action_seconds", labels, time.perf_counter() - start)
+        return result
         # js = itop.query(self.json_data())
         # for name, obj in js.get("objects", {}).items():
         #     obj["__calculated__"] = {}
@@ -275,40 +611,218 @@ class ListAction(Action):
 
 
 class GetAction(Action):
-    def __init__(self, iclass, key=None, output="*", required=[], calculated=[]):
+    def __init__(self, iclass, key=None, output="*", itop=None, cache=True, required=[], calculated=[], profile=None):
         if key is None:
             key = "SELECT {0}".format(iclass)
         super(GetAction, self).__init__(operation="core/get",
                                         iclass=iclass,
                                         key=key,
                                         output=output,
-                                        calculated=calculated)
+                                        itop=itop,
+                                        cache=cache,
+                                        calculated=calculated,
+                                        profile=profile)
+
+
+    def iter(self, key=None, output=None, page_size=100, profile=None):
+        """Iterate over the matching objects, fetching them one page at a time.
+
+        Arguments:
+            key (str, int, dict, optional): Key attribute override.
+            output (str, list, optional): Output attribute override.
+            page_size (int, optional): Number of objects per page (`None` to fetch all objects at once).
+            profile (str, optional): Output fields profile (used if `output` is not set).
+
+        Yields the iTop objects (`dict` with 'code', 'message', 'class', 'key' and 'fields')
+        as soon as they are decoded from the response stream.
+        """
+        itop = self.resolve_itop()
+        page = 1
+        while True:
+            action = self.prepare(key=key, output=output, profile=profile, limit=page_size, page=page)
+            count = 0
+            for _, obj in itop.query_stream(action.json_data()):
+                count += 1
+                yield obj
+            if page_size is None or count < page_size:
+                break
+            page += 1
+
+
+    def lookup(self, keys, classify=None, output=None, max_bytes=8000, profile=None):
+        """Fetch many objects by keys of mixed kinds, with as few queries as possible.
+
+        The keys are classified into `(field, value)` criteria, compiled into OQL
+        queries such as `SELECT Incident WHERE title IN (...) OR friendlyname IN (...) OR id IN (...)`
+        (within the action's own key), and split into chunks of at most `max_bytes`.
+
+        Arguments:
+            keys (list of int, str): Objects keys.
+            classify (callable, optional): Called as `classify(key)`, returns a `(field, value)` tuple
+                or `None` for unsupported keys. Default to IDs only.
+            output (list, optional): Output attribute override (the lookup fields are added to it).
+            max_bytes (int, optional): Maximum size of an OQL query.
+            profile (str, optional): Output fields profile (used if `output` is not set).
+
+        Returns an `OrderedDict` of keys to objects (`None` for the keys not found or not supported),
+        or an awaitable resolved with it when the selected iTop instance is an `AsyncITop`.
+        """
+        classify = classify is not None and classify or (lambda k: (isinstance(k, int) or str(k).isdigit()) and ("id", int(k)) or None)
+        if output is None and profile is not None:
+            output = get_profile(self.iclass, profile)
+        output = output is not None and output or self.output
+        # Classify keys.
+        criteria = OrderedDict()
+        for key in keys:
+            criterion = classify(key)
+            if criterion is None:
+                self.logger.warning("unsupported lookup key: {0}".format(key))
+            else:
+                criteria.setdefault(criterion, []).append(key)
+        if type(output) in [list, set]:
+            output = list(output) + [f for f in OrderedDict.fromkeys([f for f, _ in criteria]) if f != "id" and f not in output]
+        # Compile queries.
+        base = len(oql(self.iclass, self.key, "()"))
+
+        def compile(chunk):
+            fields = OrderedDict()
+            for field, value in chunk:
+                fields.setdefault(field, []).append(quote(value))
+            condition = " OR ".join(["{0} IN ({1})".format(f, ", ".join(v)) for f, v in fields.items()])
+            return self.prepare(key=oql(self.iclass, self.key, "({0})".format(condition)), output=output).json_data()
+
+        payloads, chunk, size = [], [], base
+        for field, value in criteria:
+            length = len(field) + len(quote(value)) + 10
+            if len(chunk) > 0 and size + length > max_bytes:
+                payloads.append(compile(chunk))
+                chunk, size = [], base
+            chunk.append((field, value))
+            size += length
+        if len(chunk) > 0:
+            payloads.append(compile(chunk))
+        # Run queries and index the objects by criterion.
+        self.logger.info("looking up {0} key(s) with {1} query(ies)".format(len(keys), len(payloads)))
+        fields = set([f for f, _ in criteria])
+
+        def collect(responses):
+            found = {}
+            for res in responses:
+                if isinstance(res, Exception):
+                    raise res
+                if res.get("code", 0) != 0:
+                    raise Exception("iTop error (code={0}): {1}".format(res.get("code"), res.get("message")))
+                for _, obj in (res.get("objects") or {}).items():
+                    for field in fields:
+                        value = field == "id" and int(obj["key"]) or obj["fields"].get(field)
+                        found[(field, value)] = obj
+            results = OrderedDict([(k, None) for k in keys])
+            for criterion, criterion_keys in criteria.items():
+                for key in criterion_keys:
+                    results[key] = found.get(criterion)
+            return results
+
+        responses = self.resolve_itop().query_many(payloads)
+        if hasattr(responses, "__await__"):
+
+            async def collect_async():
+                return collect(await responses)
+
+            return collect_async()
+        return collect(responses)
 
 
 class CreateAction(Action):
-    def __init__(self, iclass, fields={}, output="*", required=[], calculated=[]):
+    def __init__(self, iclass, fields={}, output="*", itop=None, required=[], calculated=[], profile=None):
         super(CreateAction, self).__init__(operation="core/create",
                                            iclass=iclass,
                                            fields=fields,
                                            output=output,
-                                           calculated=calculated)
+                                           itop=itop,
+                                           calculated=calculated,
+                                           profile=profile)
 
 
 class UpdateAction(Action):
-    def __init__(self, iclass, key=None, fields={}, output="*", required=[], calculated=[]):
+    def __init__(self, iclass, key=None, fields={}, output="*", itop=None, required=[], calculated=[], profile=None):
         super(UpdateAction, self).__init__(operation="core/update",
                                            iclass=iclass,
                                            key=key,
                                            fields=fields,
                                            output=output,
-                                           calculated=calculated)
+                                           itop=itop,
+                                           calculated=calculated,
+                                           profile=profile)
 
 
 class StimulateAction(Action):
-    def __init__(self, iclass, stimulus, fields={}, output="*", required=[], calculated=[]):
+    def __init__(self, iclass, stimulus, fields={}, output="*", itop=None, required=[], calculated=[], profile=None):
         super(StimulateAction, self).__init__(operation="core/apply_stimulus",
                                               iclass=iclass,
                                               stimulus=stimulus,
                                               fields=fields,
                                               output=output,
-                                              calculated=calculated)
+                                              itop=itop,
+                                              calculated=calculated,
+                                              profile=profile)
+
+
+class UpsertAction(Action):
+    """Create an object, or update it if it already exists.
+
+    The existence check, the object key and the fields needed to compute the
+    update are fetched by a single `core/get`, which is followed by exactly one
+    write (`core/create` or `core/update` by object ID).
+    """
+
+    def __init__(self, get, create, update, lookup=["id"]):
+        """Initialize the class instance.
+
+        Arguments:
+            get (object): Lookup action (`GetAction`).
+            create (object): Creation action (`CreateAction`).
+            update (object): Update action (`UpdateAction`).
+            lookup (list of str, optional): Fields fetched along the existence check.
+        """
+        super(UpsertAction, self).__init__(iclass=get.iclass, itop=get.itop)
+        self.get = get
+        self.create = create
+        self.update = update
+        self.lookup = lookup
+
+    def __call__(self, key=None, fields=None, changes=None, lookup=None):
+        """Excecute the upsert.
+
+        Arguments:
+            key (str, int, dict, optional): Lookup key override.
+            fields (dict, callable, optional): Creation fields override, or a callable returning them (only called on creation).
+            changes (dict, callable, optional): Update fields, or a callable receiving the existing
+                object (with its `lookup` fields) and returning them (`None` to skip the update).
+            lookup (list of str, optional): Lookup fields override.
+
+        Returns a `(status, result)` tuple, where status is one of 'created', 'updated' or 'unchanged'.
+        """
+        itop = self.resolve_itop()
+        # Existence check.
+        lookup = lookup is not None and lookup or self.lookup
+        res = itop.query(self.get.prepare(key=key, output=lookup).json_data(), cache=False)
+        if res.get("code", 0) != 0:
+            raise Exception("iTop error (code={0}): {1}".format(res.get("code"), res.get("message")))
+        objects = res.get("objects") or {}
+        if len(objects) > 1:
+            raise Exception("Ambiguous upsert key: {0} objects found".format(len(objects)))
+        # Creation.
+        if len(objects) == 0:
+            self.logger.info("object not found, creating")
+            if callable(fields):
+                fields = fields()
+            return "created", itop.query(self.create.prepare(fields=fields).json_data())
+        # Update.
+        obj = [o for _, o in objects.items()][0]
+        if callable(changes):
+            changes = changes(obj)
+        if changes is None:
+            self.logger.info("object found, nothing to update")
+            return "unchanged", None
+        self.logger.info("object found, updating (key={0})".format(obj["key"]))
+        return "updated", itop.query(self.update.prepare(key=int(obj["key"]), fields=changes).json_data())
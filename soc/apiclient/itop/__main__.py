@@ -1,14 +1,13 @@
-import os
 import sys
 import logging
 import json
-try:
-    import importlib
-except Exception:
-    pass
+import atexit
 import argparse
-import glob
-from . import notify_mail, ITop, ListAction, GetAction, CreateAction, LOADED_FACTORIES
+from . import ITop, ListAction, GetAction, CreateAction, LOADED_FACTORIES
+from soc_apiclient_itop_client import DEFAULT_SOCKET
+from .logs import setup_logging
+from .mirror import Mirror
+from .registry import load_factory, load_factories, get_manifest, command_factory
 
 
 # Logging globals.
@@ -20,73 +19,138 @@ itop = None
 loaded_factories = {}
 
 
-# Hardcoded error notification mail.
-error_mail = """
-<html>
-    <body>
-        <h1 style="color:Tomato;">soc.apiclient.itop error</h1>
-        <br>
-        {err}
-    </body>
-</html>
-"""
+# Global options applied once by the daemon (see `daemon.CommandServer`), by destination.
+DAEMON_SETTINGS = ["config", "logfile", "log_format", "cache_ttl", "cache_size", "adaptive", "rate", "timeout", "mirror", "metrics_file", "mail_server", "mail_recipients", "mail_interval"]
 
+# Error notifier (see `get_notifier`).
+notifier = None
 
-def load_factories():
-    """Load all available factories at once.
+
+def get_notifier(args):
+    """Return the error notifier, created on first use.
+
+    The daemon sends the digests from a background thread, other processes
+    leave them to a detached sender process.
     """
-    facts_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "factories", "*.py")
-    logger.info("locating all factories from '{0}'".format(facts_path))
-    for factory_path in [f for f in glob.glob(facts_path)]:
-        factory_name = os.path.basename(factory_path).split(".py")[0]
-        if factory_name not in ["__init__", ]:
-            logger.info("loading factory '{0}' from '{1}'".format(factory_name, factory_path))
-            try:
-                LOADED_FACTORIES[factory_name] = importlib.machinery.SourceFileLoader("factories.{0}".format(factory_name), factory_path).load_module()
-            except Exception:
-                LOADED_FACTORIES[factory_name] = __import__("soc.apiclient.itop.factories.{0}".format(factory_name), fromlist=["soc.apiclient.itop.factories"])
+    global notifier
+    if notifier is None:
+        from .notify import MailNotifier
+        notifier = MailNotifier(server=args.mail_server, recipients=args.mail_recipients, interval=args.mail_interval,
+                                detached=getattr(args, "daemon", None) is None)
+        atexit.register(notifier.close)
+    return notifier
 
 
-def main():
-    # Load loaded_factories.
-    load_factories()
+def notify_error(args, error):
+    """Spool an error notification mail if requested by the command line.
+
+    Errors of all the processes are aggregated in digests sent in background (see `notify.MailNotifier`).
+    """
+    if args.notify_mail is True:
+        get_notifier(args).notify(error)
+
+
+def write_metrics(path):
+    """Write the requests metrics to a file (JSON or Prometheus text format, depending on the file extension).
+    """
+    from .metrics import METRICS
+    with open(path, 'w') as fd:
+        fd.write(path.endswith(".json") and METRICS.dump_json() or METRICS.prometheus())
+
+
+def command_serve(args):
+    """Serve the commands over a Unix socket, keeping the iTop session and the factories warm.
+    """
+    import signal
+    from .daemon import CommandServer
+    server = CommandServer(args.socket, build_parser(), on_error=notify_error, settings=args, fixed=DAEMON_SETTINGS)
+    logger.info("serving commands on '{0}'".format(args.socket))
+    # SIGTERM stops the server as SIGINT does: the pending writes are flushed at exit.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("interrupted")
+    finally:
+        server.server_close()
+
+
+def build_parser(manifest=None):
+    """Build the arguments parser from the loaded factories.
+
+    Arguments:
+        manifest (dict, optional): Factories manifest. If set, the commands parsers are
+            placeholders built from the manifest, and no factory is loaded.
+    """
     # Arguments parser.
     parser = argparse.ArgumentParser(description="SOC client API for iTop")
     # Globals arguments.
     parser.add_argument("--config", type=str, help="iTOP API configuration file")
     parser.add_argument("--logfile", type=str, default=None, help="Log file path")
+    parser.add_argument("--format", type=str, dest="output_format", choices=["table", "json", "ndjson", "csv"], default=None, help="Objects output format of the read commands (written as soon as they are received)")
+    parser.add_argument("--log-format", type=str, dest="log_format", choices=["text", "json"], default="text", help="Log records format")
+    parser.add_argument("--cache-ttl", type=float, dest="cache_ttl", default=None, help="Cache 'core/get' results for the given number of seconds")
+    parser.add_argument("--cache-size", type=int, dest="cache_size", default=256, help="Maximum number of cached results")
+    parser.add_argument("--adaptive", dest="adaptive", action="store_true", help="Adapt the number of concurrent requests to the iTop latency and errors, and retry failed reads")
+    parser.add_argument("--rate", type=float, dest="rate", default=None, help="Maximum number of requests per second (implies '--adaptive')")
+    parser.add_argument("--timeout", type=float, dest="timeout", default=None, help="HTTP requests timeout, in seconds")
+    parser.add_argument("--mirror", type=str, dest="mirror", default=None, help="Local mirror database path (see 'core-sync')")
+    parser.add_argument("--metrics-file", type=str, dest="metrics_file", default=None, help="Write the requests metrics to the given file at exit (JSON if the file name ends with '.json', Prometheus text format otherwise)")
     parser.add_argument("--notify-mail", dest="notify_mail", action="store_true", help="Send a mail notification is case of error")
     parser.add_argument("--mail-server", type=str, dest="mail_server", default="127.0.0.1", help="Mail server for error notification")
     parser.add_argument("--mail-recipients", type=str, dest="mail_recipients", default=["soc@excellium-services.com", "jpclipffel@excellium-services.com"], nargs='+', help="Mail recipients")
+    parser.add_argument("--mail-interval", type=float, dest="mail_interval", default=60.0, help="Minimum delay between two error notification mails, in seconds (errors are aggregated in digests)")
     # Commands sub-parsers.
     sp = parser.add_subparsers(dest="command", help="Command")
     sp.required = True
     # Factories parsers.
-    for name, factory in LOADED_FACTORIES.items():
-        if getattr(factory, "add_parser", None) is not None:
-            factory.add_parser(sp)
+    if manifest is not None:
+        for name, commands in sorted(manifest["factories"].items()):
+            for command in commands:
+                p_command = sp.add_parser(command["name"], help=command["help"], add_help=False)
+                p_command.add_argument("arguments", nargs=argparse.REMAINDER)
+    else:
+        for name, factory in LOADED_FACTORIES.items():
+            if getattr(factory, "add_parser", None) is not None:
+                factory.add_parser(sp)
+    # Daemon parser.
+    p_serve = sp.add_parser("daemon-serve", help="Serve commands over a Unix socket (use 'soc.apiclient.itop-client' to forward commands)")
+    p_serve.set_defaults(func=command_serve)
+    p_serve.add_argument("--socket", type=str, default=DEFAULT_SOCKET, help="Unix socket path")
+    return parser
+
+
+def main():
+    # Select the command from the cached factories manifest, then load its factory only.
+    manifest = get_manifest()
+    args, _ = build_parser(manifest=manifest).parse_known_args()
+    if args.command == "daemon-serve":
+        load_factories()
+    else:
+        load_factory(command_factory(manifest, args.command))
     # Parse arguments.
-    args = parser.parse_args()
-    # Logging.
-    if args.logfile is not None:
-        logger.addHandler(logging.handlers.RotatingFileHandler(args.logfile, mode='a', maxBytes=1000000, backupCount=0))
-    logformatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    for handler in logger.handlers:
-        handler.setFormatter(logformatter)
+    args = build_parser().parse_args()
+    # Logging (records are written by a background thread).
+    setup_logging(logger, logfile=args.logfile, fmt=args.log_format)
+    # Metrics.
+    if args.metrics_file is not None:
+        atexit.register(write_metrics, args.metrics_file)
     # Execution.
     try:
         # Connect iTop.
-        itop = ITop(config=args.config)
+        limiter = None
+        if args.adaptive is True or args.rate is not None:
+            from .throttle import AdaptiveLimiter
+            limiter = AdaptiveLimiter(rate=args.rate)
+        itop = ITop(config=args.config, cache_ttl=args.cache_ttl, cache_size=args.cache_size, limiter=limiter, timeout=args.timeout)
+        if args.mirror is not None:
+            Mirror(args.mirror)
         # Run command.
         args.func(args)
     except Exception as error:
         logger.error(str(error))
         logger.exception(error)
-        if args.notify_mail is True:
-            notify_mail(subject="soc.apiclient.itop error",
-                        payload=error_mail.format(err=str(error)),
-                        server=args.mail_server,
-                        recipients=args.mail_recipients)
+        notify_error(args, error)
         raise error
 
 
@@ -0,0 +1,143 @@
+import json
+import time
+import asyncio
+try:
+    import aiohttp
+except Exception:
+    aiohttp = None
+from soc.apiclient.itop import ITop, Action
+from soc.apiclient.itop.logs import LazyJson
+from soc.apiclient.itop.throttle import IDEMPOTENT_OPERATIONS
+from soc.apiclient.itop.metrics import METRICS, labels_of
+
+
+class AsyncITop(ITop):
+    """Asyncio counterpart of `ITop`.
+
+    Actions bound to an `AsyncITop` instance (either explicitly through their
+    `itop` argument or through the global default instance) return awaitables:
+
+        itop = AsyncITop(config="./soc_apiclient_itop.cfg.json", max_concurrency=32)
+        persons = GetAction(iclass="Person", output=["name"], itop=itop)
+        async with itop:
+            results = await asyncio.gather(persons(key=1), persons(key=2))
+    """
+
+    def __init__(self, config=None, max_concurrency=16, pool_size=None, keepalive=30, **kwargs):
+        """Initialize the class instance.
+
+        Arguments:
+            config (str, optional): iTop API configuration file path.
+            max_concurrency (int, optional): Maximum number of in-flight requests.
+            pool_size (int, optional): Maximum number of pooled connections (default to `max_concurrency`).
+            keepalive (int, float, optional): Idle keep-alive connections timeout, in seconds.
+
+        The other `ITop` arguments (ex: `cache_ttl`, `limiter`, `timeout`) apply as well.
+        """
+        if aiohttp is None:
+            raise Exception("AsyncITop requires the 'aiohttp' package (install 'soc_apiclient_itop[async]')")
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size is not None and pool_size or max_concurrency
+        self.keepalive = keepalive
+        self.semaphore = None
+        super(AsyncITop, self).__init__(config=config, pool_size=self.pool_size, **kwargs)
+
+    def setup(self):
+        """Defer the HTTP transport setup: `aiohttp` sessions must be created from a running event loop.
+        """
+        self.logger.info("deferring aiohttp session setup (pool_size={0}, max_concurrency={1})".format(self.pool_size, self.max_concurrency))
+        self.session = None
+
+    async def open(self):
+        """Create the pooled keep-alive session (no-op if already opened).
+        """
+        if self.session is None:
+            self.logger.info("setting-up aiohttp session (warning: SSL verification disabled !)")
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive, ssl=False)
+            self.session = aiohttp.ClientSession(connector=connector)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def close(self):
+        """Close the pooled session.
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            self.semaphore = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def query(self, payload, cache=True):
+        if self.cache is not None:
+            result = self.cache.lookup(payload, cache)
+            if result is not None:
+                METRICS.inc("itop_cache_hits_total", labels_of(payload))
+                self.logger.info("cache hit (operation='{0}', class='{1}')".format(payload.get("operation", None), payload.get("class", None)))
+                return result
+            generation = self.cache.generation(payload.get("class", None))
+        labels = labels_of(payload)
+        self.check_output(payload)
+        await self.open()
+        self.logger.info("querying (address='{0}', operation='{1}')".format(self.query_url, payload.get("operation", None)))
+        self.logger.info("payload: %s", LazyJson(payload), extra=labels)
+        data = self.credentials()
+        start = time.perf_counter()
+        data["json_data"] = json.dumps(payload)
+        METRICS.inc("itop_json_encode_seconds_total", labels, time.perf_counter() - start)
+        METRICS.inc("itop_request_bytes_total", labels, len(data["json_data"]))
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        async def post():
+            # Every attempt is counted (retried and failed ones included).
+            METRICS.inc("itop_requests_total", labels)
+            async with self.semaphore:
+                start = time.perf_counter()
+                try:
+                    async with self.session.post(self.query_url, data=data, timeout=timeout) as response:
+                        content = await response.read()
+                except Exception:
+                    METRICS.inc("itop_request_errors_total", dict(labels, code="exception"))
+                    raise
+            METRICS.observe("itop_request_seconds", labels, time.perf_counter() - start)
+            if response.status >= 500:
+                METRICS.inc("itop_request_errors_total", dict(labels, code="http_{0}".format(response.status)))
+                raise Exception("iTop HTTP error: {0} {1}".format(response.status, response.reason))
+            METRICS.inc("itop_response_bytes_total", labels, len(content))
+            start = time.perf_counter()
+            result = json.loads(content)
+            METRICS.inc("itop_json_decode_seconds_total", labels, time.perf_counter() - start)
+            return result
+
+        try:
+            if self.limiter is None:
+                result = await post()
+            else:
+                result = await self.limiter.run_async(post, idempotent=payload.get("operation", None) in IDEMPOTENT_OPERATIONS)
+        except Exception:
+            if self.cache is not None:
+                self.cache.store(payload, None, cache)
+            raise
+        self.account(payload, result.get("code", 0), len(result.get("objects") or {}))
+        if self.cache is not None:
+            self.cache.store(payload, result, cache, generation)
+        return result
+
+    def query_stream(self, payload, chunk_size=65536):
+        raise Exception("AsyncITop does not support streamed queries")
+
+    async def query_many(self, payloads):
+        """Run several queries concurrently (bounded by `max_concurrency`).
+
+        Arguments:
+            payloads (list): `Action` instances or raw iTop payloads (`dict`).
+
+        Returns the results in input order. A failed item holds the raised
+        `Exception` instance instead of its result.
+        """
+        payloads = [isinstance(p, Action) and p.json_data() or p for p in payloads]
+        return await asyncio.gather(*[self.query(p) for p in payloads], return_exceptions=True)
@@ -0,0 +1,131 @@
+import copy
+import json
+import time
+import logging
+import threading
+try:
+    from collections import OrderedDict
+except Exception:
+    from ordereddict import OrderedDict
+
+
+# Operations which invalidate the cached results of their class.
+WRITE_OPERATIONS = ["core/create", "core/update", "core/apply_stimulus"]
+
+
+class QueryCache(object):
+    """Read-through TTL / LRU cache for `core/get` results.
+
+    Entries are keyed on the normalized query payload. Write operations
+    (`core/create`, `core/update` and `core/apply_stimulus`) invalidate all the
+    cached results of the class they touch, whatever their key, both before
+    and after they are sent. Each invalidation bumps the class generation: a
+    read started before it completed is not cached, as it may hold pre-write data.
+    """
+
+    def __init__(self, ttl=60, size=256):
+        """Initialize the class instance.
+
+        Arguments:
+            ttl (int, float, optional): Entries time-to-live, in seconds.
+            size (int, optional): Maximum number of entries (least recently used entries are evicted first).
+        """
+        self.logger = logging.getLogger("soc.apiclient.itop.QueryCache")
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(payload):
+        """Return the normalized cache key of a query payload.
+        """
+        return json.dumps(payload, sort_keys=True)
+
+    def get(self, payload):
+        """Return a copy of the cached result of a query, or `None`.
+        """
+        key = self.make_key(payload)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, _, result = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return copy.deepcopy(result)
+
+    def generation(self, iclass):
+        """Return the current generation of a class (changed by each invalidation).
+        """
+        with self.lock:
+            return (self.epoch, self.generations.get(iclass, 0))
+
+    def put(self, payload, result, generation=None):
+        """Cache the result of a query.
+
+        Arguments:
+            payload (dict): iTop query payload.
+            result (dict): iTop response.
+            generation (tuple, optional): Class generation when the query was sent
+                (see `generation`), the result is dropped if the class was invalidated since.
+        """
+        key = self.make_key(payload)
+        result = copy.deepcopy(result)
+        with self.lock:
+            if generation is not None and generation != (self.epoch, self.generations.get(payload.get("class"), 0)):
+                self.logger.info("dropped result invalidated while in flight (class='{0}')".format(payload.get("class")))
+                return
+            self.entries[key] = (time.time() + self.ttl, payload.get("class"), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, iclass=None):
+        """Drop the cached results of a class (all results if `iclass` is `None`).
+        """
+        with self.lock:
+            if iclass is None:
+                self.epoch += 1
+                self.entries.clear()
+            else:
+                self.generations[iclass] = self.generations.get(iclass, 0) + 1
+                for key in [k for k, (_, c, _) in self.entries.items() if c == iclass]:
+                    del self.entries[key]
+        self.logger.info("invalidated cached results (class='{0}')".format(iclass))
+
+    def lookup(self, payload, cache=True):
+        """Handle a query payload before it is sent: return a cached result for
+        cacheable reads, or invalidate the cached results touched by writes.
+
+        Arguments:
+            payload (dict): iTop query payload.
+            cache (bool, optional): Whether the query may be served from the cache.
+        """
+        operation = payload.get("operation", None)
+        if operation == "core/get" and cache is True:
+            return self.get(payload)
+        if operation in WRITE_OPERATIONS:
+            self.invalidate(payload.get("class"))
+        return None
+
+    def store(self, payload, result, cache=True, generation=None):
+        """Handle a query result: cache successful reads, or invalidate again
+        the cached results touched by writes (reads may have been cached while
+        the write was in flight).
+
+        Arguments:
+            payload (dict): iTop query payload.
+            result (dict): iTop response.
+            cache (bool, optional): Whether the result may be cached.
+            generation (tuple, optional): Class generation when the query was sent (see `generation`).
+        """
+        operation = payload.get("operation", None)
+        if operation == "core/get" and cache is True and isinstance(result, dict) and result.get("code", 0) == 0:
+            self.put(payload, result, generation)
+        elif operation in WRITE_OPERATIONS:
+            self.invalidate(payload.get("class"))
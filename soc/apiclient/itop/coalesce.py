@@ -0,0 +1,132 @@
+import json
+import logging
+import threading
+from concurrent.futures import Future
+
+
+class CoalescingWriter(object):
+    """Write-coalescing queue in front of an `UpdateAction`.
+
+    Updates are buffered per `(class, key)` for a time window, starting with the
+    first buffered update. Their fields are merged (the `public_log` texts are
+    concatenated, other fields such as `status` keep their last value) and a
+    single update is sent per object when the window expires.
+
+    With a `lookup` action, keys are resolved to object IDs first, so that the
+    updates of an object selected in different ways (ID, friendly name, title...)
+    share a bucket. Otherwise, the keys must be identical to be coalesced.
+    """
+
+    def __init__(self, action, window=2.0, separator="\n", concatenated=["public_log"], lookup=None):
+        """Initialize the class instance.
+
+        Arguments:
+            action (object): Update action (`UpdateAction`).
+            window (int, float, optional): Default buffering window, in seconds.
+            separator (str, optional): Separator used to concatenate text fields.
+            concatenated (list of str, optional): Fields concatenated instead of overwritten.
+            lookup (object, optional): Get action (`GetAction`) used to resolve the keys to object IDs.
+        """
+        self.logger = logging.getLogger("soc.apiclient.itop.CoalescingWriter")
+        self.action = action
+        self.window = window
+        self.separator = separator
+        self.concatenated = concatenated
+        self.lookup = lookup
+        self.keys = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, key):
+        """Return the object ID selected by a key (resolutions are cached: object IDs never change).
+
+        Arguments:
+            key (int, str, dict): Object key.
+        """
+        if isinstance(key, int) or (isinstance(key, str) and key.isdigit()):
+            return int(key)
+        name = json.dumps(key, sort_keys=True)
+        if name not in self.keys:
+            res = self.lookup(key=key, output=["id"])
+            if res.get("code", 0) != 0:
+                raise Exception("iTop error (code={0}): {1}".format(res.get("code"), res.get("message")))
+            objects = res.get("objects") or {}
+            if len(objects) != 1:
+                raise Exception("Coalesced update key must select exactly one object ({0} found): {1}".format(len(objects), name))
+            self.keys[name] = int([o for _, o in objects.items()][0]["key"])
+        return self.keys[name]
+
+    def merge(self, current, fields):
+        """Merge new update fields into the buffered ones.
+        """
+        for name, value in fields.items():
+            if name in self.concatenated and name in current:
+                current[name] = "{0}{1}{2}".format(current[name], self.separator, value)
+            else:
+                current[name] = value
+
+    def submit(self, key, fields, window=None):
+        """Buffer an update.
+
+        Arguments:
+            key (int, str, dict): Object key.
+            fields (dict): Updated fields.
+            window (int, float, optional): Buffering window, in seconds (default to the writer's one),
+                applied if no update of the object is buffered yet.
+
+        Returns a `Future` resolved with the result of the merged update, or
+        failed with its error (including iTop and key resolution errors).
+        """
+        future = Future()
+        if self.lookup is not None:
+            try:
+                key = self.resolve(key)
+            except Exception as error:
+                future.set_exception(error)
+                return future
+        name = (self.action.iclass, json.dumps(key, sort_keys=True))
+        window = window is not None and window or self.window
+        with self.lock:
+            entry = self.pending.get(name)
+            if entry is None:
+                entry = {"key": key, "fields": {}, "futures": [], "timer": threading.Timer(window, self.flush_key, [name])}
+                entry["timer"].daemon = True
+                entry["timer"].start()
+                self.pending[name] = entry
+            self.merge(entry["fields"], fields)
+            entry["futures"].append(future)
+        return future
+
+    def flush_key(self, name):
+        """Send the merged update of an object.
+        """
+        with self.lock:
+            entry = self.pending.pop(name, None)
+        if entry is None:
+            return
+        entry["timer"].cancel()
+        self.logger.info("flushing {0} coalesced update(s) (class='{1}', key={2})".format(len(entry["futures"]), name[0], name[1]))
+        try:
+            action = self.action.prepare(key=entry["key"], fields=entry["fields"])
+            result = action.resolve_itop().query(action.json_data())
+            # The callers are gone (ex: daemon): iTop errors are failures too.
+            if result.get("code", 0) != 0:
+                raise Exception("iTop error (code={0}): {1}".format(result.get("code"), result.get("message")))
+        except Exception as error:
+            self.logger.error("coalesced update failed (class='{0}', key={1}): {2}".format(name[0], name[1], str(error)))
+            for future in entry["futures"]:
+                future.set_exception(error)
+        else:
+            for future in entry["futures"]:
+                future.set_result(result)
+
+    def flush(self):
+        """Send all the buffered updates now.
+        """
+        with self.lock:
+            names = list(self.pending.keys())
+        for name in names:
+            self.flush_key(name)
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,144 @@
+import io
+import os
+import sys
+import json
+import logging
+import contextlib
+import socketserver
+
+
+class ForwardedStdin(io.TextIOBase):
+    """Standard input of the forwarded commands: the caller's input is not forwarded.
+    """
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        raise Exception("the standard input cannot be forwarded to the daemon (use an input file instead)")
+
+    def readline(self, size=-1):
+        return self.read()
+
+
+@contextlib.contextmanager
+def forwarded_context(cwd=None):
+    """Run a forwarded command from the caller's working directory, without standard input.
+
+    Arguments:
+        cwd (str, optional): Caller's working directory.
+    """
+    previous = os.getcwd()
+    stdin, sys.stdin = sys.stdin, ForwardedStdin()
+    try:
+        if cwd is not None:
+            os.chdir(cwd)
+        yield
+    finally:
+        os.chdir(previous)
+        sys.stdin = stdin
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """Handle a single forwarded command line.
+
+    Protocol: the client sends one JSON line (`{"argv": [...], "cwd": str}`) and the server
+    answers with one JSON line (`{"code": int, "stdout": str, "stderr": str}`).
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            response = self.server.execute(request["argv"], cwd=request.get("cwd", None))
+        except Exception as error:
+            response = {"code": 1, "stdout": "", "stderr": "invalid request: {0}\n".format(str(error))}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class CommandServer(socketserver.UnixStreamServer):
+    """Unix socket server running CLI commands in a warm process.
+
+    The iTop session and the loaded factories are kept resident between calls.
+    Commands are executed one at a time: their output is captured by
+    redirecting `sys.stdout` and `sys.stderr`, and they run from the caller's
+    working directory, which are all process-wide.
+    """
+
+    def __init__(self, path, parser, on_error=None, settings=None, fixed=[]):
+        """Initialize the class instance.
+
+        Arguments:
+            path (str): Unix socket path.
+            parser (object): CLI arguments parser (`argparse.ArgumentParser`).
+            on_error (callable, optional): Called as `on_error(args, error)` when a command fails.
+            settings (object, optional): Daemon's own arguments (`argparse.Namespace`).
+            fixed (list of str, optional): Global options applied once by the daemon (by destination),
+                rejected if a forwarded command sets them to another value.
+        """
+        self.logger = logging.getLogger("soc.apiclient.itop.daemon")
+        self.path = path
+        self.parser = parser
+        self.on_error = on_error
+        self.settings = settings
+        self.fixed = fixed
+        if os.path.exists(path):
+            self.logger.info("removing stale socket '{0}'".format(path))
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, CommandHandler)
+        os.chmod(path, 0o660)
+
+    def check(self, args):
+        """Reject the global options which cannot be applied to a forwarded command.
+        """
+        options = dict([(a.dest, "/".join(a.option_strings)) for a in self.parser._actions])
+        for dest in self.fixed:
+            value = getattr(args, dest, None)
+            if value != self.parser.get_default(dest) and value != getattr(self.settings, dest, None):
+                raise Exception("global option '{0}' cannot be applied to a forwarded command (restart 'daemon-serve' with it)".format(options.get(dest, dest)))
+
+    def execute(self, argv, cwd=None):
+        """Parse and run a command line.
+
+        The parsed arguments are given a `daemon` attribute (this server), so that
+        commands may report the errors of their deferred work through `on_error`.
+
+        Arguments:
+            argv (list of str): Command line arguments.
+            cwd (str, optional): Caller's working directory (relative paths are resolved against it).
+        """
+        self.logger.info("running command: {0}".format(" ".join(argv)))
+        stdout, stderr = io.StringIO(), io.StringIO()
+        code = 0
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            args = None
+            try:
+                args = self.parser.parse_args(argv)
+                if args.command == "daemon-serve":
+                    raise Exception("command 'daemon-serve' cannot be forwarded")
+                if args.command == "incident-siem-watch" and getattr(args, "once", False) is not True:
+                    raise Exception("command 'incident-siem-watch' can only be forwarded with '--once' (the daemon runs one command at a time)")
+                self.check(args)
+                args.daemon = self
+                if cwd is not None and not os.path.isdir(cwd):
+                    raise Exception("invalid working directory: '{0}'".format(cwd))
+                with forwarded_context(cwd):
+                    args.func(args)
+            except SystemExit as exit:
+                if isinstance(exit.code, int):
+                    code = exit.code
+                elif exit.code is not None:
+                    print(exit.code, file=sys.stderr)
+                    code = 1
+            except Exception as error:
+                self.logger.error(str(error))
+                self.logger.exception(error)
+                print(str(error), file=sys.stderr)
+                code = 1
+                if args is not None and self.on_error is not None:
+                    self.on_error(args, error)
+        return {"code": code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
@@ -2,7 +2,12 @@ import os
 import glob
 import json
 import soc.apiclient.itop
-from soc.apiclient.itop import keys_to_dict, LOADED_FACTORIES
+from soc.apiclient.itop import keys_to_dict
+from soc.apiclient.itop import get_profile
+from soc.apiclient.itop.registry import load_factory, load_factories, get_manifest
+from soc.apiclient.itop.mirror import MIRRORED, get_mirror
+from soc.apiclient.itop.output import write_objects
+from soc.apiclient.itop.metrics import METRICS
 
 
 # def invalid_factory(name):
@@ -16,7 +21,7 @@ def command_list(args):
     def list_factories(args):
         # globexpr = os.path.join(os.path.dirname(os.path.abspath(__file__)), "factories", "*.py")
         # factories = [p.split('.')[0] for p in [os.path.basename(p) for p in glob.glob(globexpr)] if p not in ["__init__.py", ]]
-        for name, _ in LOADED_FACTORIES.items():
+        for name in sorted(get_manifest()["factories"]):
             print(name)
 
     what_func = {
@@ -29,36 +34,63 @@ def command_list(args):
 
 
 def command_get(args):
-    print(LOADED_FACTORIES)
-    factory = LOADED_FACTORIES.get(args.iclass)
-    if factory is None:
-        raise Exception("Invalid factory: '{0}'".format(args.iclass))
+    factory = load_factory(args.iclass)
     key = keys_to_dict(args.keys)
-    if len(args.output) < 1:
-        res = factory.get(key=key)
+    output = len(args.output) > 0 and args.output or None
+    fmt = getattr(args, "output_format", None)
+    if fmt is not None:
+        # Objects are written as soon as they are received (or read from the mirror).
+        if args.local is True:
+            if output is None and args.profile is not None:
+                output = get_profile(factory.get.iclass, args.profile)
+            objects = get_mirror().iter(factory.get.iclass, key=key, output=output)
+        else:
+            objects = factory.get.iter(key=key, output=output, page_size=args.page_size, profile=args.profile)
+        write_objects(objects, fmt)
+    elif args.local is True:
+        if output is None and args.profile is not None:
+            output = get_profile(factory.get.iclass, args.profile)
+        if args.stream is True or args.page_size is not None:
+            for obj in get_mirror().iter(factory.get.iclass, key=key, output=output):
+                print(json.dumps(obj, indent=2))
+        else:
+            print(json.dumps(get_mirror().get(factory.get.iclass, key=key, output=output), indent=2))
+    elif args.stream is True or args.page_size is not None:
+        for obj in factory.get.iter(key=key, output=output, page_size=args.page_size, profile=args.profile):
+            print(json.dumps(obj, indent=2))
     else:
-        res = factory.get(key=key, output=args.output)
-    print(json.dumps(res, indent=2))
+        res = factory.get(key=key, output=output, profile=args.profile)
+        print(json.dumps(res, indent=2))
 
 
 def command_create(args):
-    factory = LOADED_FACTORIES.get(args.iclass)
-    if factory is None:
-        raise Exception("Invalid factory: '{0}'".format(args.iclass))
+    factory = load_factory(args.iclass)
     fields = keys_to_dict(args.fields)
-    res = factory.create(fields=fields)
+    res = factory.create(fields=fields, profile=args.profile)
     print(json.dumps(res, indent=2))
 
 
 def command_update(args):
-    factory = LOADED_FACTORIES.get(args.iclass)
-    if factory is None:
-        raise Exception("Invalid factory: '{0}'".format(args.iclass))
+    factory = load_factory(args.iclass)
     fields = keys_to_dict(args.fields)
-    res = factory.update(key=args.key, fields=fields)
+    res = factory.update(key=args.key, fields=fields, profile=args.profile)
     print(json.dumps(res, indent=2))
 
 
+def command_sync(args):
+    load_factories()
+    classes = len(args.iclass) > 0 and args.iclass or list(MIRRORED.keys())
+    for iclass in classes:
+        print(json.dumps(get_mirror().sync(iclass, full=args.full)))
+
+
+def command_metrics(args):
+    if args.format == "json":
+        print(METRICS.dump_json())
+    else:
+        print(METRICS.prometheus(), end="")
+
+
 def add_parser(sp):
     """Add parsers to base parsing structure.
 
@@ -74,15 +106,30 @@ def add_parser(sp):
     p_get.set_defaults(func=command_get)
     p_get.add_argument("iclass", help="Class name")
     p_get.add_argument("--output", default=[], nargs='+', help="Output fields")
+    p_get.add_argument("--profile", type=str, default=None, help="Output fields profile (ex: 'minimal', 'table'), ignored if '--output' is set")
     p_get.add_argument("--keys", default=[], nargs='+', help="Filtering keys")
+    p_get.add_argument("--page-size", type=int, dest="page_size", default=None, help="Fetch and print objects by pages of the given size")
+    p_get.add_argument("--stream", dest="stream", action="store_true", help="Print objects one by one as soon as they are received")
+    p_get.add_argument("--local", dest="local", action="store_true", help="Read the objects from the local mirror (see 'core-sync')")
+    # 'sync' command.
+    p_sync = sp.add_parser("core-sync", help="Synchronize the local mirror")
+    p_sync.set_defaults(func=command_sync)
+    p_sync.add_argument("iclass", default=[], nargs='*', help="Mirrored classes (default to all)")
+    p_sync.add_argument("--full", dest="full", action="store_true", help="Take a full snapshot instead of an incremental update")
+    # 'metrics' command.
+    p_metrics = sp.add_parser("core-metrics", help="Print the requests metrics of the current process (see 'daemon-serve')")
+    p_metrics.set_defaults(func=command_metrics)
+    p_metrics.add_argument("--format", choices=["prometheus", "json"], default="prometheus", help="Output format")
     # 'create' command.
     p_create = sp.add_parser("core-create", help="Create a given class instance")
     p_create.set_defaults(func=command_create)
     p_create.add_argument("iclass", help="Class name")
     p_create.add_argument("--fields", default=[], nargs='+', help="New object fields")
+    p_create.add_argument("--profile", type=str, default=None, help="Returned object fields profile (ex: 'minimal')")
     # 'update' command.
     p_update = sp.add_parser("core-update", help="Update a given class instance")
     p_update.set_defaults(func=command_update)
     p_update.add_argument("iclass", help="Class name")
     p_update.add_argument("key", type=int, help="Class instance key")
     p_update.add_argument("--fields", default=[], nargs='+', help="Updated fields")
+    p_update.add_argument("--profile", type=str, default=None, help="Returned object fields profile (ex: 'minimal')")
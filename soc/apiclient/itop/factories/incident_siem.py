@@ -1,20 +1,37 @@
+import os
 import sys
 import logging
 import json
-from tabulate import tabulate
-from pkg_resources import resource_filename as pkgrs
+import atexit
+import argparse
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
-from soc.apiclient.itop import keys_to_dict, render_template, parse_vars, GetAction, CreateAction, UpdateAction
+from soc.apiclient.itop import keys_to_dict, render_template, parse_vars, GetAction, CreateAction, UpdateAction, UpsertAction, register_profile, get_profile
+from soc.apiclient.itop.registry import load_factory
+from soc.apiclient.itop.publog import PublogIndex
+from soc.apiclient.itop.coalesce import CoalescingWriter
+from soc.apiclient.itop.mirror import register_mirror, get_mirror
+from soc.apiclient.itop.watch import watch
+from soc.apiclient.itop.output import write_objects
 
 
 logger = logging.getLogger("soc.apiclient.itop.incident_siem")
 
 
+register_profile("Incident", "minimal", ["friendlyname", "title", "operational_status"])
+register_profile("Incident", "table", ["title", "friendlyname", "org_id", "org_id_friendlyname", "operational_status"])
+register_profile("Incident", "publog", ["public_log"])
+register_profile("Incident", "mirror", ["title", "friendlyname", "org_id", "org_id_friendlyname", "operational_status", "status", "last_update"])
+
+
 get = GetAction(iclass="Incident",
-                output=["title", "friendlyname", "org_id", "org_id_friendlyname", "operational_status"],
+                profile="table",
                 key={"service_name": "CSOC - Security Monitoring"})
 
 
+# Writes return all the fields: the printed responses are parsed by SIEM scripts.
 create = CreateAction(iclass="Incident", fields={
     "service_id": {"name": "CSOC - Security Monitoring"},
     "servicesubcategory_id": {"name": "Security Incident (Escalated)"},
@@ -29,27 +46,61 @@ create = CreateAction(iclass="Incident", fields={
 
 update = UpdateAction(iclass="Incident")
 
+
+upsert = UpsertAction(get, create, update)
+
+
+# Local mirror (see 'core-sync').
+register_mirror(get, get_profile("Incident", "mirror"), indexes=["title", "friendlyname", "org_id"], hwm="last_update")
+
+
+# Coalescing public log writer (see `get_writer`).
+writer = None
+
 # update_stimulus = StimulateAction(iclass="Incident", stimulus=None)
 
 
+def get_writer():
+    """Return the coalescing public log writer, flushed at exit (incidents keys are
+    resolved to IDs, the coalescing window is given per update).
+    """
+    global writer
+    if writer is None:
+        writer = CoalescingWriter(update, lookup=get)
+        atexit.register(writer.close)
+    return writer
+
+
 def get_org_key(args):
+    """Return the organization ID, resolving codes and names through the local organizations index.
+    """
     if getattr(args, "org_id", None) is not None:
         return args.org_id
     elif getattr(args, "org_code", None) is not None:
-        return {"code": args.org_code}
+        return load_factory("organizations").index.resolve("code", args.org_code)
     elif getattr(args, "org_name", None) is not None:
-        return {"name": args.org_name}
+        return load_factory("organizations").index.resolve("name", args.org_name)
+    return None
+
+
+def classify_inc_key(inc):
+    """Return the `(field, value)` criterion of an incident key (ID, name or title), or `None`.
+    """
+    inc = str(inc)
+    if inc.isdigit():
+        return ("id", int(inc))
+    elif re.match("I-([0-9]*)", inc):
+        return ("friendlyname", inc)
+    elif re.match("SOC-([a-zA-Z]*)-SIEM-([0-9]).*", inc):
+        return ("title", inc)
     return None
 
 
 def get_inc_key(args):
     if getattr(args, "inc", None) is not None:
-        if args.inc.isdigit():
-            return int(args.inc)
-        elif re.match("I-([0-9]*)", args.inc):
-            return {"friendlyname": args.inc}
-        elif re.match("SOC-([a-zA-Z]*)-SIEM-([0-9]).*", args.inc):
-            return {"title": args.inc}
+        criterion = classify_inc_key(args.inc)
+        if criterion is not None:
+            return criterion[0] == "id" and criterion[1] or dict([criterion])
     elif getattr(args, "inc_id", None) is not None:
         return int(args.inc_id)
     elif getattr(args, "inc_name", None) is not None:
@@ -75,27 +126,23 @@ def command_get(args):
     # Setup organization's key selector
     if org_key is not None:
         key["org_id"] = org_key
-    # Run query and assert results.
-    res = get(key)
-    incidents = res.get("objects", {})
-    if incidents is None:
-        incidents = {}
-    # Display results.
-    table = []
-    for inc in [inc for _, inc in incidents.items()]:
-        table.append([inc["key"],
-                      inc["fields"]["friendlyname"],
-                      inc["fields"]["title"],
-                      inc["fields"]["org_id"],
-                      inc["fields"]["org_id_friendlyname"],
-                      inc["fields"]["operational_status"]])
-    print(tabulate(table, headers=["Incident ID", "Incident Reference", "Incident Name", "Organization ID", "Organization Name", "Status"]))
+    # Run query and display results.
+    if args.local is True:
+        incidents = get_mirror().iter("Incident", key)
+    else:
+        incidents = get.iter(key, page_size=args.page_size)
+    write_objects(incidents,
+                  getattr(args, "output_format", None) or "table",
+                  columns=["friendlyname", "title", "org_id", "org_id_friendlyname", "operational_status"],
+                  headers=["Incident ID", "Incident Reference", "Incident Name", "Organization ID", "Organization Name", "Status"])
 
 
 def command_exists(args, interactive=True):
     """Check if a given case already exists.
     """
     logger.info("invoking command_exists")
+    if getattr(args, "incs", None) is not None:
+        return command_exists_many(args, interactive)
     key     = {}
     inc_key = get_inc_key(args)
     # Setup incident's key selector
@@ -105,7 +152,10 @@ def command_exists(args, interactive=True):
         else:
             key = inc_key
     # Run query
-    res = get(key)
+    if getattr(args, "local", False) is True:
+        res = get_mirror().get("Incident", key, output=get_profile("Incident", "minimal"))
+    else:
+        res = get(key, profile="minimal")
     if res["objects"] is not None and len(res["objects"]) > 0:
         logger.info("incident exists")
         if interactive is True:
@@ -120,6 +170,28 @@ def command_exists(args, interactive=True):
         return False
 
 
+def command_exists_many(args, interactive=True):
+    """Check if several cases already exist, with batched queries.
+
+    One NDJSON line is printed per incident; the exit code is 0 if all of them exist.
+    """
+    if getattr(args, "local", False) is True:
+        results = OrderedDict()
+        for inc in args.incs:
+            criterion = classify_inc_key(inc)
+            objects = criterion is not None and list(get_mirror().iter("Incident", criterion[0] == "id" and criterion[1] or dict([criterion]))) or []
+            results[inc] = len(objects) > 0 and objects[0] or None
+    else:
+        results = get.lookup(args.incs, classify=classify_inc_key, profile="minimal")
+    missing = len([o for o in results.values() if o is None])
+    logger.info("{0} incident(s) found, {1} missing".format(len(results) - missing, missing))
+    if interactive is True:
+        for inc, obj in results.items():
+            print(json.dumps({"inc": inc, "exists": obj is not None, "key": obj is not None and obj["key"] or None}))
+        sys.exit(missing > 0 and 1 or 0)
+    return results
+
+
 def command_publog(args, interactive=True):
     """Add a public log.
     """
@@ -135,19 +207,30 @@ def command_publog(args, interactive=True):
     # Extract incident comments is needed.
     if args.diff is True:
         logger.info("extracting existing comments to performs the diff")
-        res = get(key, output=["public_log"])
+        res = get(key, profile="publog")
         if res["objects"] is not None and len(res["objects"]) == 1:
             for name, obj in res["objects"].items():
-                for pl in obj["fields"]["public_log"]["entries"]:
-                    logger.info("applying delta on text")
-                    try:
-                        args.text = re.sub(pl["message"], '', args.text, 1)
-                    except Exception:
-                        pass
-                    logger.info("new text: ['{text}']".format(text=args.text))
+                logger.info("applying delta on text")
+                args.text = PublogIndex(obj["fields"]["public_log"]["entries"]).strip(args.text)
+                logger.info("new text: ['{text}']".format(text=args.text))
     # Run.
     if len(args.text) > 0:
         fields = {"public_log": args.text, "status": "pending"}
+        if getattr(args, "coalesce", None) is not None:
+            logger.info("queuing public log (coalescing window: {0}s)".format(args.coalesce))
+            future = get_writer().submit(key, fields, window=args.coalesce)
+            daemon = getattr(args, "daemon", None)
+            if daemon is None or future.done():
+                # One-shot (or key resolution failure): wait for the flush, its errors are the command errors.
+                res = future.result()
+            else:
+                # Daemon: the caller is answered now, the flush errors are reported later.
+                if daemon.on_error is not None:
+                    future.add_done_callback(lambda f: f.exception() is not None and daemon.on_error(args, f.exception()))
+                res = {"queued": True}
+            if interactive is True:
+                print(json.dumps(res, indent=daemon is None and 2 or None))
+            return res
         # res = update_stimulus(key, {"status": "new"}, stimulus="ev_new")
         res = update(key, {"public_log": args.text, "status": "pending"})
         # res = update_stimulus(key, {"public_log": args.text, "status": "pending"}, stimulus="ev_pending")
@@ -159,32 +242,129 @@ def command_publog(args, interactive=True):
         logger.info("no public log to append (probable delta strip result)")
 
 
-def command_create(args, interactive=True):
-    """Create or update a security incident.
+def upsert_incident(args, variables):
+    """Create a security incident, or append a public log to the existing one.
+
+    The existence check and the existing public log (if `args.diff` is set) are
+    fetched by a single query, followed by a single write.
+
+    Arguments:
+        args (object): Incident arguments (`inc_title`, `inc_urgency`, `text`, `template`, `diff` and organization selector).
+        variables (dict): Template variables.
+
+    Returns a `(status, result)` tuple (see `UpsertAction`).
     """
-    logger.info("invoking command_create")
-    exists = command_exists(args, interactive=False)
-    if not exists:
+
+    def fields():
         logger.info("creating new incident")
-        variables = {}
-        variables.update(parse_vars(args.vars))
-        variables.update({"comment": args.text})
-        fields = {
+        tpl_vars = {}
+        tpl_vars.update(variables)
+        tpl_vars.update({"comment": args.text})
+        return {
             "org_id": get_org_key(args),
             "title": args.inc_title,
-            "description": render_template(args.template, variables),
+            "description": render_template(args.template, tpl_vars),
             "urgency": args.inc_urgency,
             "public_log": args.text
         }
-        res = create(fields=fields)
-        if interactive is True:
-            print(json.dumps(res, indent=2))
-    else:
+
+    def changes(inc):
         logger.info("updating exisiting incident")
-        res = command_publog(args, interactive=False)
+        text = args.text
+        if args.diff is True:
+            logger.info("applying delta on text")
+            text = PublogIndex(inc["fields"]["public_log"]["entries"]).strip(text)
+            logger.info("new text: ['{text}']".format(text=text))
+        if len(text) == 0:
+            logger.info("no public log to append (probable delta strip result)")
+            return None
+        return {"public_log": text, "status": "pending"}
+
+    return upsert(get_inc_key(args), fields=fields, changes=changes, lookup=args.diff is True and get_profile("Incident", "publog") or ["id"])
+
+
+def command_create(args, interactive=True):
+    """Create or update a security incident.
+    """
+    logger.info("invoking command_create")
+    status, res = upsert_incident(args, parse_vars(args.vars))
+    if status == "created" and interactive is True:
+        print(json.dumps(res, indent=2))
     return res
 
 
+def command_bulk(args, interactive=True):
+    """Create or update security incidents from a stream of NDJSON alert records.
+
+    Records are grouped by incident title: the alerts of a group are folded into
+    a single creation or public log append, and the groups are processed
+    concurrently. One NDJSON outcome is printed per record.
+    """
+    logger.info("invoking command_bulk")
+    # Read and group records.
+    groups = OrderedDict()
+    outcomes = []
+    with (args.input == "-" and contextlib.nullcontext(sys.stdin) or open(args.input, 'r')) as fd:
+        for line_number, line in enumerate(fd, 1):
+            if len(line.strip()) == 0:
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict) or not record.get("title") or not record.get("text"):
+                    raise Exception("record requires 'title' and 'text'")
+            except Exception as error:
+                outcomes.append({"line": line_number, "status": "error", "error": str(error)})
+                continue
+            groups.setdefault(record["title"], []).append((line_number, record))
+    for outcome in outcomes:
+        print(json.dumps(outcome))
+
+    def run(title, records):
+        first = records[0][1]
+        variables = {}
+        for _, record in records:
+            variables.update(record.get("vars", {}))
+        inc_args = argparse.Namespace(inc_title=title,
+                                      inc_urgency=first.get("urgency", 4),
+                                      org_id=first.get("org_id"),
+                                      org_code=first.get("org_code"),
+                                      org_name=first.get("org_name"),
+                                      text="\n".join([r["text"] for _, r in records]),
+                                      template=args.template,
+                                      diff=args.diff)
+        status, res = upsert_incident(inc_args, variables)
+        if res is not None and res.get("code", 0) != 0:
+            raise Exception("iTop error (code={0}): {1}".format(res.get("code"), res.get("message")))
+        keys = [o["key"] for _, o in ((res or {}).get("objects") or {}).items()]
+        return status, len(keys) > 0 and keys[0] or None
+
+    # Run groups concurrently.
+    failed = len(outcomes)
+    workers = max(1, args.workers)
+    itop = upsert.resolve_itop()
+    if workers > getattr(itop, "pool_size", workers):
+        itop.mount_pool(workers)
+    logger.info("processing {0} incidents (workers={1})".format(len(groups), workers))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = dict([(executor.submit(run, title, records), (title, records)) for title, records in groups.items()])
+        for future in as_completed(futures):
+            title, records = futures[future]
+            try:
+                status, key = future.result()
+                outcome = {"status": status, "key": key}
+            except Exception as error:
+                logger.error("cannot process incident '{0}': {1}".format(title, str(error)))
+                outcome = {"status": "error", "error": str(error)}
+                failed += len(records)
+            for line_number, _ in records:
+                line = {"line": line_number, "title": title}
+                line.update(outcome)
+                print(json.dumps(line))
+            sys.stdout.flush()
+    if interactive is True and failed > 0:
+        sys.exit(1)
+
+
 def command_resolve(args, interactive=True):
     """switch a security incident state to 'Resolved'.
     """
@@ -205,6 +385,15 @@ def command_resolve(args, interactive=True):
     return res
 
 
+def command_watch(args):
+    """Print the created, updated and status-changed incidents as NDJSON events.
+    """
+    logger.info("invoking command_watch")
+    for event in watch("Incident", interval=args.interval, cycles=args.once is True and 1 or None, name=args.name):
+        print(json.dumps(event))
+        sys.stdout.flush()
+
+
 def add_parser(sp):
     """Add parsers to base parsing structure.
 
@@ -225,6 +414,18 @@ def add_parser(sp):
     p_get_args.add_argument("--inc-id", type=int, dest="inc_id", help="Incident ID")
     p_get_args.add_argument("--inc-name", type=str, dest="inc_name", help="Incident name (looks like 'I-01234')")
     p_get_args.add_argument("--inc-title", type=str, dest="inc_title", help="Incident title (looks like 'SOC-CUST-SIEM-01234')")
+    # Pagination
+    p_get.add_argument("--page-size", type=int, dest="page_size", default=None, help="Fetch incidents by pages of the given size")
+    p_get.add_argument("--local", dest="local", action="store_true", help="Read the incidents from the local mirror (see 'core-sync')")
+
+    # =========================================================================
+    # 'watch' command.
+    # =========================================================================
+    p_watch = sp.add_parser("incident-siem-watch", help="Print incidents changes as NDJSON events")
+    p_watch.set_defaults(func=command_watch)
+    p_watch.add_argument("--interval", type=float, default=30.0, help="Polling interval, in seconds")
+    p_watch.add_argument("--once", dest="once", action="store_true", help="Poll once and exit (the watch state is kept in the local mirror)")
+    p_watch.add_argument("--name", type=str, default="incident-siem-watch", help="Watcher name (each watcher keeps its own state in the local mirror)")
 
     # =========================================================================
     # 'exists' command.
@@ -237,6 +438,8 @@ def add_parser(sp):
     p_exists_args.add_argument("--inc-id", type=int, dest="inc_id", help="Incident ID")
     p_exists_args.add_argument("--inc-name", type=str, dest="inc_name", help="Incident name (looks like 'I-01234')")
     p_exists_args.add_argument("--inc-title", type=str, dest="inc_title", help="Incident title (looks like 'SOC-CUST-SIEM-01234')")
+    p_exists_args.add_argument("--incs", type=str, dest="incs", nargs='+', help="Several incidents (IDs, names or titles), checked with batched queries")
+    p_exists.add_argument("--local", dest="local", action="store_true", help="Check the local mirror (see 'core-sync')")
 
     # =========================================================================
     # 'publog' command.
@@ -252,6 +455,7 @@ def add_parser(sp):
     # Comment
     p_publog.add_argument("--text", type=str, dest="text", required=True, help="Public log text (may contains basic HTML)")
     p_publog.add_argument("--diff", dest="diff", action="store_true", help="Keep only the difference between the existing comments and new text")
+    p_publog.add_argument("--coalesce", type=float, dest="coalesce", default=None, help="Queue the public log and merge it with the other ones received for the same incident within the given number of seconds (see 'daemon-serve')")
 
     # =========================================================================
     # 'create' command.
@@ -267,12 +471,22 @@ def add_parser(sp):
     p_create.add_argument("--inc-title", type=str, dest="inc_title", required=True, help="Incident title (looks like 'SOC-CUST-SIEM-01234')")
     p_create.add_argument("--inc-urgency", type=int, dest="inc_urgency", required=True, choices=[1, 2, 3, 4], help="Incident urgency (from 1 to 4)")
     # Template
-    p_create.add_argument("--template", type=str, default=pkgrs(__name__, "static/incident_siem_template.html"), required=False, help="iTop mail template (supports Jinja2 HTML template)")
+    p_create.add_argument("--template", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "incident_siem_template.html"), required=False, help="iTop mail template (supports Jinja2 HTML template)")
     p_create.add_argument("--vars", type=str, default=[], nargs='+', dest="vars", required=False, help="iTop mail template arguments as `key:value` list")
     # Public log
     p_create.add_argument("--text", type=str, dest="text", required=True, help="Comment and 1st public log text (may contains basic HTML)")
     p_create.add_argument("--diff", dest="diff", action="store_true", help="Keep only the difference between the existing comments and new text")
 
+    # =========================================================================
+    # 'bulk' command.
+    # =========================================================================
+    p_bulk = sp.add_parser("incident-siem-bulk", help="Create or update SIEM incidents from NDJSON alert records")
+    p_bulk.set_defaults(func=command_bulk)
+    p_bulk.add_argument("--input", type=str, default="-", help="NDJSON records file ('-' for stdin)")
+    p_bulk.add_argument("--workers", type=int, default=8, help="Number of incidents processed concurrently")
+    p_bulk.add_argument("--template", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "incident_siem_template.html"), required=False, help="iTop mail template (supports Jinja2 HTML template)")
+    p_bulk.add_argument("--diff", dest="diff", action="store_true", help="Keep only the difference between the existing comments and new text")
+
     # =========================================================================
     # 'resolve' command.
     # =========================================================================
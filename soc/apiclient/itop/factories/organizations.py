@@ -1,22 +1,38 @@
 import json
-from tabulate import tabulate
-from soc.apiclient.itop import keys_to_dict, GetAction, CreateAction, UpdateAction
+from soc.apiclient.itop import keys_to_dict, GetAction, CreateAction, UpdateAction, register_profile
+from soc.apiclient.itop.orgindex import OrganizationIndex
+from soc.apiclient.itop.mirror import register_mirror, get_mirror
+from soc.apiclient.itop.output import write_objects
+
+
+# Fields profiles
+# ===============
+register_profile("Organization", "minimal", ["name", "code"])
+register_profile("Organization", "table", ["id", "code", "name"])
 
 
 # Factories
 # =========
-get = GetAction(iclass="Organization", output=["name", "code", "id"])
+get = GetAction(iclass="Organization", profile="table")
+
+# Organizations index (code, name and friendly name to ID), with a snapshot per iTop instance.
+index = OrganizationIndex(get, snapshot=lambda: get.resolve_itop().cache_path("organizations.json"))
+
+# Local mirror (see 'core-sync'), fully refreshed on each sync.
+register_mirror(get, ["id", "code", "name", "friendlyname"], indexes=["code", "name", "friendlyname"])
 
 
 # Sub-parser and commands
 # =======================
 
 def command_get(args):
-    res = get()
-    table = []
-    for org in [org for _, org in res["objects"].items()]:
-        table.append([org["fields"]["id"], org["fields"]["code"], org["fields"]["name"]])
-    print(tabulate(table, headers=["ID", "Code", "Name"]))
+    if args.refresh is True:
+        index.fetch()
+    if args.local is True:
+        organizations = get_mirror().iter("Organization")
+    else:
+        organizations = get.iter(page_size=args.page_size)
+    write_objects(organizations, getattr(args, "output_format", None) or "table", columns=["id", "code", "name"], headers=["ID", "Code", "Name"], key=False)
 
 
 def add_parser(sp):
@@ -28,3 +44,6 @@ def add_parser(sp):
     # 'get' command.
     p_get = sp.add_parser("orgs-get", help="List organization")
     p_get.set_defaults(func=command_get)
+    p_get.add_argument("--page-size", type=int, dest="page_size", default=None, help="Fetch organizations by pages of the given size")
+    p_get.add_argument("--refresh", dest="refresh", action="store_true", help="Rebuild the local organizations index")
+    p_get.add_argument("--local", dest="local", action="store_true", help="Read the organizations from the local mirror (see 'core-sync')")
@@ -1,4 +1,13 @@
-from soc.apiclient.itop import GetAction
+from soc.apiclient.itop import GetAction, register_profile, get_profile
+from soc.apiclient.itop.mirror import register_mirror
 
 
-get = GetAction(iclass="Person", output="*")
+register_profile("Person", "minimal", ["friendlyname", "email"])
+register_profile("Person", "table", ["name", "first_name", "email", "phone", "function", "org_id_friendlyname"])
+
+
+get = GetAction(iclass="Person", profile="table")
+
+
+# Local mirror (see 'core-sync'), fully refreshed on each sync.
+register_mirror(get, get_profile("Person", "table") + ["friendlyname", "org_id"], indexes=["friendlyname", "email", "org_id"])
@@ -0,0 +1,118 @@
+import sys
+import json
+import copy
+import queue
+import atexit
+import logging
+import logging.handlers
+
+
+# Standard `LogRecord` attributes (anything else was given through `extra` and is structured data).
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None)).keys()) | set(["message", "asctime"])
+
+
+def truncate(value, max_length):
+    """Return a copy of a JSON-like value with its long strings truncated.
+
+    Arguments:
+        value (object): JSON-like value (`dict`, `list`, `str`, ...).
+        max_length (int): Maximum strings length.
+    """
+    if isinstance(value, str):
+        if len(value) > max_length:
+            return "{0}...(+{1} chars)".format(value[:max_length], len(value) - max_length)
+        return value
+    elif isinstance(value, dict):
+        return dict([(k, truncate(v, max_length)) for k, v in value.items()])
+    elif isinstance(value, (list, tuple)):
+        return [truncate(v, max_length) for v in value]
+    return value
+
+
+class LazyJson(object):
+    """JSON rendering of a payload, deferred until the log record is formatted.
+
+    Pass it as a logging argument (`logger.info("payload: %s", LazyJson(payload))`):
+    nothing is serialized if the level is disabled, and the serialization happens
+    in the logging thread otherwise. The payload must not be modified once logged.
+    """
+
+    __slots__ = ["payload", "max_length"]
+
+    def __init__(self, payload, max_length=256):
+        """Initialize the class instance.
+
+        Arguments:
+            payload (object): JSON-serializable payload.
+            max_length (int, optional): Maximum rendered strings length (ex: `fields`, `public_log`).
+        """
+        self.payload = payload
+        self.max_length = max_length
+
+    def __str__(self):
+        return json.dumps(truncate(self.payload, self.max_length), default=str)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as JSON lines, including their structured (`extra`) attributes.
+    """
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                data[name] = value
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler leaving the message formatting to the listener thread.
+
+    The standard `QueueHandler` formats records in the calling thread (to make
+    them picklable); records are only shared between threads here, so their
+    arguments are kept as-is and rendered by the listener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info:
+            # Tracebacks are rendered now, while the frames are still relevant.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(logger, logfile=None, fmt="text"):
+    """Move the logger handlers behind a queue, written by a background thread.
+
+    Arguments:
+        logger (object): Logger to setup (its current handlers are moved behind the queue).
+        logfile (str, optional): Log file path (rotated).
+        fmt (str, optional): Records format ('text' or 'json').
+
+    Returns the started `QueueListener` (stopped at exit).
+    """
+    handlers = [h for h in logger.handlers if not isinstance(h, logging.handlers.QueueHandler)]
+    if len(handlers) == 0:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    if logfile is not None:
+        handlers.append(logging.handlers.RotatingFileHandler(logfile, mode='a', maxBytes=1000000, backupCount=0))
+    formatter = fmt == "json" and JsonFormatter() or logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        logger.removeHandler(handler)
+    records = queue.Queue(-1)
+    logger.addHandler(LazyQueueHandler(records))
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
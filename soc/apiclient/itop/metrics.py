@@ -0,0 +1,121 @@
+import json
+import threading
+
+
+# Latency histograms buckets, in seconds.
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# Metrics help strings (Prometheus export).
+HELP = {
+    "itop_requests_total": "iTop REST requests",
+    "itop_request_errors_total": "iTop REST requests errors, by iTop error code (or 'http_<status>' / 'exception')",
+    "itop_request_seconds": "iTop REST requests latency",
+    "itop_request_bytes_total": "iTop REST requests payload size",
+    "itop_response_bytes_total": "iTop REST responses body size",
+    "itop_response_objects_total": "Objects returned by iTop",
+    "itop_json_encode_seconds_total": "Time spent encoding requests payloads",
+    "itop_json_decode_seconds_total": "Time spent decoding responses bodies",
+    "itop_action_seconds": "Actions invocation latency",
+    "itop_cache_hits_total": "Queries served from the results cache",
+    "itop_wildcard_queries_total": "Queries requesting all the objects fields (no output fields profile)",
+}
+
+
+def labels_of(payload):
+    """Return the metrics labels of a query payload.
+    """
+    return {"operation": payload.get("operation", None), "class": payload.get("class", None)}
+
+
+class Metrics(object):
+    """Thread-safe counters and histograms registry, with Prometheus and JSON exports.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        return (name, tuple(sorted([(k, v is not None and str(v) or "") for k, v in labels.items()])))
+
+    def inc(self, name, labels={}, value=1):
+        """Increment a counter.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels={}, value=0):
+        """Record a value in a histogram.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def as_dict(self):
+        """Return the metrics as a JSON-serializable `dict`.
+        """
+        with self.lock:
+            return {
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.counters.items())],
+                "histograms": [{"name": n,
+                                "labels": dict(l),
+                                "buckets": dict(zip([str(b) for b in self.buckets], h["buckets"])),
+                                "sum": h["sum"],
+                                "count": h["count"]} for (n, l), h in sorted(self.histograms.items())]
+            }
+
+    def dump_json(self):
+        """Return the metrics as a JSON document.
+        """
+        return json.dumps(self.as_dict(), indent=2)
+
+    def prometheus(self):
+        """Return the metrics in Prometheus text exposition format.
+        """
+
+        def fmt(labels, extra=[]):
+            labels = list(labels) + extra
+            if len(labels) == 0:
+                return ""
+            return "{" + ",".join(['{0}="{1}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels]) + "}"
+
+        lines = []
+        with self.lock:
+            declared = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in declared:
+                    declared.add(name)
+                    lines.append("# HELP {0} {1}".format(name, HELP.get(name, name)))
+                    lines.append("# TYPE {0} counter".format(name))
+                lines.append("{0}{1} {2}".format(name, fmt(labels), value))
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in declared:
+                    declared.add(name)
+                    lines.append("# HELP {0} {1}".format(name, HELP.get(name, name)))
+                    lines.append("# TYPE {0} histogram".format(name))
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    lines.append("{0}_bucket{1} {2}".format(name, fmt(labels, [("le", str(bound))]), count))
+                lines.append("{0}_bucket{1} {2}".format(name, fmt(labels, [("le", "+Inf")]), histogram["count"]))
+                lines.append("{0}_sum{1} {2}".format(name, fmt(labels), histogram["sum"]))
+                lines.append("{0}_count{1} {2}".format(name, fmt(labels), histogram["count"]))
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide metrics registry.
+METRICS = Metrics()
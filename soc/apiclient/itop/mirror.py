@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+import soc.apiclient.itop
+from soc.apiclient.itop import quote, oql
+
+
+# Default mirror database path (`None` for one database per iTop instance, see `ITop.cache_path`).
+MIRROR_PATH = None
+
+# Default mirror instance (see `get_mirror`).
+MIRROR = None
+
+# Mirrored classes specifications, by class (see `register_mirror`).
+MIRRORED = OrderedDict()
+
+
+def register_mirror(action, fields, indexes=[], hwm=None):
+    """Register a class to mirror locally.
+
+    Arguments:
+        action (object): Get action (`GetAction`) selecting the mirrored objects.
+        fields (list of str): Mirrored fields.
+        indexes (list of str, optional): Indexed fields.
+        hwm (str, optional): High-water mark field used for incremental syncs (ex: 'last_update').
+            Classes without high-water mark are fully refreshed on each sync.
+    """
+    fields = list(fields)
+    if hwm is not None and hwm not in fields:
+        fields.append(hwm)
+    columns = [f for f in fields if f != "id"]
+    MIRRORED[action.iclass] = {"action": action, "fields": fields, "columns": columns, "indexes": list(indexes), "hwm": hwm}
+
+
+def get_mirror():
+    """Return the default mirror instance (the database of the current iTop instance, unless a path was given).
+    """
+    if MIRROR is not None and (MIRROR.itop is None or MIRROR.itop is soc.apiclient.itop.ITOP_INSTANCE):
+        return MIRROR
+    return Mirror(MIRROR_PATH)
+
+
+class Mirror(object):
+    """Local SQLite mirror of iTop objects.
+
+    Each mirrored class is stored in its own table (one text column per mirrored
+    field, plus the original object as JSON). The first sync of a class takes
+    a full snapshot; following syncs of classes with a high-water mark only fetch
+    the objects updated since the last one.
+    """
+
+    def __init__(self, path=None):
+        """Initialize the class instance.
+
+        Arguments:
+            path (str, optional): Database path (default to a database per iTop instance:
+                snapshots and high-water marks of an instance must not be mixed with another one's).
+        """
+        self.logger = logging.getLogger("soc.apiclient.itop.Mirror")
+        self.itop = None
+        if path is None:
+            self.itop = soc.apiclient.itop.ITOP_INSTANCE
+            if self.itop is None:
+                raise Exception("Mirror requires a database path or a valid ITop instance")
+            path = self.itop.cache_path("mirror.sqlite")
+        # Absolute path: the daemon runs the forwarded commands from their caller's directory.
+        self.path = os.path.abspath(path)
+        self.connection = None
+        self.lock = threading.RLock()
+        setattr(sys.modules[__name__], "MIRROR", self)
+
+    def connect(self):
+        """Return the database connection, opening it (and creating the metadata table) if needed.
+        """
+        import sqlite3
+        with self.lock:
+            if self.connection is None:
+                if not os.path.isdir(os.path.dirname(self.path)):
+                    os.makedirs(os.path.dirname(self.path))
+                self.logger.info("opening mirror '{0}'".format(self.path))
+                self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.execute("CREATE TABLE IF NOT EXISTS mirror_sync (class TEXT PRIMARY KEY, spec TEXT, hwm TEXT, timestamp REAL)")
+            return self.connection
+
+    @staticmethod
+    def table(iclass):
+        return '"mirror_{0}"'.format(iclass)
+
+    def spec(self, iclass):
+        spec = MIRRORED.get(iclass)
+        if spec is None:
+            raise Exception("Class '{0}' is not mirrored (available: {1})".format(iclass, ", ".join(MIRRORED.keys()) or "none"))
+        return spec
+
+    def state(self, iclass):
+        """Return the sync state (`spec`, `hwm` and `timestamp`) of a class, or `None` if never synced.
+        """
+        row = self.connect().execute("SELECT spec, hwm, timestamp FROM mirror_sync WHERE class = ?", (iclass, )).fetchone()
+        return row is not None and {"spec": row[0], "hwm": row[1], "timestamp": row[2]} or None
+
+    def create(self, iclass, spec):
+        """(Re)create the table of a class.
+        """
+        columns = ", ".join(['"{0}" TEXT'.format(f) for f in spec["columns"]])
+        db = self.connect()
+        db.execute("DROP TABLE IF EXISTS {0}".format(self.table(iclass)))
+        db.execute("CREATE TABLE {0} (id INTEGER PRIMARY KEY, {1}, data TEXT)".format(self.table(iclass), columns))
+        for field in spec["indexes"]:
+            db.execute('CREATE INDEX "mirror_{0}_{1}" ON {2} ("{1}")'.format(iclass, field, self.table(iclass)))
+
+    def sync(self, iclass, full=False, page_size=500, on_change=None):
+        """Synchronize a class.
+
+        Arguments:
+            iclass (str): iTop object class name.
+            full (bool, optional): Force a full snapshot.
+            page_size (int, optional): Number of objects fetched per request.
+            on_change (callable, optional): Called as `on_change(previous, current)` for each object
+                fetched by an incremental sync (`previous` is `None` for new objects).
+
+        Returns a `dict` with the sync 'mode', the number of 'fetched' objects and the 'total' number of mirrored objects.
+        """
+        spec = self.spec(iclass)
+        signature = json.dumps({"fields": spec["fields"], "indexes": spec["indexes"], "key": spec["action"].key}, sort_keys=True)
+        with self.lock:
+            db = self.connect()
+            state = self.state(iclass)
+            incremental = full is False and state is not None and state["spec"] == signature and spec["hwm"] is not None and state["hwm"] is not None
+            key = None
+            if incremental is True:
+                key = oql(iclass, spec["action"].key, "{0} >= {1}".format(spec["hwm"], quote(state["hwm"])))
+            self.logger.info("syncing class '{0}' ({1})".format(iclass, incremental and "incremental" or "full"))
+            start = time.time()
+            fetched = 0
+            columns = ", ".join(['"{0}"'.format(f) for f in spec["columns"]])
+            statement = "INSERT OR REPLACE INTO {0} (id, {1}, data) VALUES (?, {2}?)".format(self.table(iclass), columns, "?, " * len(spec["columns"]))
+            # Single transaction: readers keep seeing the previous content until the sync completes.
+            db.execute("BEGIN")
+            try:
+                if incremental is False:
+                    self.create(iclass, spec)
+                for obj in spec["action"].iter(key=key, output=spec["fields"], page_size=page_size):
+                    fetched += 1
+                    if on_change is not None and incremental is True:
+                        row = db.execute("SELECT data FROM {0} WHERE id = ?".format(self.table(iclass)), (int(obj["key"]), )).fetchone()
+                        on_change(row is not None and json.loads(row[0]) or None, obj)
+                    values = [obj["fields"].get(f) for f in spec["columns"]]
+                    values = [isinstance(v, (dict, list)) and json.dumps(v) or v for v in values]
+                    db.execute(statement, [int(obj["key"])] + values + [json.dumps(obj)])
+                hwm = None
+                if spec["hwm"] is not None:
+                    hwm = db.execute('SELECT MAX("{0}") FROM {1}'.format(spec["hwm"], self.table(iclass))).fetchone()[0]
+                db.execute("INSERT OR REPLACE INTO mirror_sync (class, spec, hwm, timestamp) VALUES (?, ?, ?, ?)", (iclass, signature, hwm, start))
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            total = db.execute("SELECT COUNT(*) FROM {0}".format(self.table(iclass))).fetchone()[0]
+        self.logger.info("synced class '{0}': {1} object(s) fetched, {2} mirrored".format(iclass, fetched, total))
+        return {"class": iclass, "mode": incremental and "incremental" or "full", "fetched": fetched, "total": total}
+
+    def iter(self, iclass, key=None, output=None):
+        """Iterate over the mirrored objects matching a key.
+
+        Arguments:
+            iclass (str): iTop object class name.
+            key (int, str, dict, optional): Object ID, fields `dict` or "SELECT <class>" (all objects).
+            output (list of str, optional): Output fields (default to all mirrored fields).
+
+        Yields the objects as returned by `core/get`.
+        """
+        spec = self.spec(iclass)
+        with self.lock:
+            if self.state(iclass) is None:
+                raise Exception("Class '{0}' is not synced yet (use 'core-sync')".format(iclass))
+        query, params = "SELECT data FROM {0}".format(self.table(iclass)), []
+        if isinstance(key, int) or (isinstance(key, str) and key.isdigit()):
+            query, params = query + " WHERE id = ?", [int(key)]
+        elif isinstance(key, dict) and len(key) > 0:
+            unknown = [k for k in key if k not in spec["columns"] and k != "id"]
+            if len(unknown) > 0:
+                raise Exception("Cannot select mirrored '{0}' objects on field(s): {1}".format(iclass, ", ".join(unknown)))
+            query = query + " WHERE " + " AND ".join(['"{0}" = ?'.format(k) for k in key])
+            params = [v for v in key.values()]
+        elif isinstance(key, str) and key.strip() != "SELECT {0}".format(iclass):
+            raise Exception("Unsupported key for mirrored '{0}' objects: {1}".format(iclass, key))
+        with self.lock:
+            rows = self.connect().execute(query + " ORDER BY id", params).fetchall()
+        for row in rows:
+            obj = json.loads(row[0])
+            if isinstance(output, list):
+                obj["fields"] = OrderedDict([(f, obj["fields"].get(f)) for f in output])
+            yield obj
+
+    def get(self, iclass, key=None, output=None):
+        """Return the mirrored objects matching a key, structured as a `core/get` response.
+
+        Arguments:
+            iclass (str): iTop object class name.
+            key (int, str, dict, optional): Object ID, fields `dict` or "SELECT <class>" (all objects).
+            output (list of str, optional): Output fields (default to all mirrored fields).
+        """
+        objects = OrderedDict([("{0}::{1}".format(iclass, o["key"]), o) for o in self.iter(iclass, key, output)])
+        return {"objects": len(objects) > 0 and objects or None, "code": 0, "message": "Found: {0}".format(len(objects))}
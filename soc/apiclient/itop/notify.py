@@ -0,0 +1,350 @@
+import os
+import re
+import sys
+import html
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import argparse
+import threading
+import subprocess
+from collections import OrderedDict
+
+
+# Digest mail template.
+DIGEST_MAIL = """
+<html>
+    <body>
+        <h1 style="color:Tomato;">soc.apiclient.itop error</h1>
+        <p>{total} error(s), {distinct} distinct, between {first} and {last}.</p>
+        <table border="1" cellpadding="4">
+            <tr><th>Count</th><th>First seen</th><th>Last seen</th><th>Error</th></tr>
+            {rows}
+        </table>
+    </body>
+</html>
+"""
+
+DIGEST_ROW = "<tr><td>{count}</td><td>{first}</td><td>{last}</td><td>{message}</td></tr>"
+
+
+def signature(error):
+    """Return the deduplication signature of an error (type and message, numbers masked).
+
+    Arguments:
+        error (Exception, str): Error.
+    """
+    return "{0}: {1}".format(type(error).__name__, re.sub("[0-9]+", "#", str(error)))[:256]
+
+
+class ErrorSpool(object):
+    """Errors spool shared by the processes: an append-only NDJSON file,
+    drained by the mail sender (see `MailNotifier`).
+    """
+
+    def __init__(self, path, max_size=1000000):
+        """Initialize the class instance.
+
+        Arguments:
+            path (str): Spool file path.
+            max_size (int, optional): Maximum spool size, in bytes (extra errors are dropped).
+        """
+        self.path = path
+        self.max_size = max_size
+
+    def append(self, sig, message, timestamp):
+        """Spool an error. Returns `False` if the spool is full.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd.fileno()).st_size >= self.max_size:
+                return False
+            fd.write(json.dumps({"signature": sig, "message": message[:4096], "timestamp": timestamp}) + "\n")
+        return True
+
+    def pending(self):
+        """Return whether errors are spooled.
+        """
+        return os.path.isfile(self.path) and os.path.getsize(self.path) > 0
+
+    def drain(self):
+        """Remove and return the spooled errors (`list` of `dict` with 'signature', 'message' and 'timestamp').
+        """
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path, 'r+') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            lines = fd.readlines()
+            fd.seek(0)
+            fd.truncate()
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except Exception:
+                pass
+        return records
+
+
+def spool_path(directory, server, port, sender, recipients, cc):
+    """Return the errors spool path of a mail configuration (errors are only mailed with the settings they were spooled with).
+    """
+    key = json.dumps([server, port, sender, sorted(recipients), sorted(cc)])
+    return os.path.join(directory, "notify", "{0}.ndjson".format(hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]))
+
+
+class MailNotifier(object):
+    """Error notifier sending periodic mail digests, shared by the processes.
+
+    Errors are appended to an on-disk spool (see `ErrorSpool`), which never
+    blocks on SMTP. A single sender, holding a lock next to the spool, drains it:
+    identical errors are deduplicated by signature and at most one digest is
+    sent per `interval` seconds over a reused SMTP connection. The sender is
+    either a thread of a long-running process (`detached=False`, ex: daemon) or
+    a detached process, started by the first failing process and exiting once idle.
+    """
+
+    def __init__(self, server="127.0.0.1", port=25, sender="", recipients=[], cc=[], subject="soc.apiclient.itop error", interval=60.0, idle_timeout=30.0, max_signatures=50, spool=None, detached=True):
+        """Initialize the class instance.
+
+        Arguments:
+            server (str, optional): SMTP server.
+            port (int, optional): SMTP server port.
+            sender (str, optional): Mail sender.
+            recipients (list of str, optional): Mail recipients.
+            cc (list of str, optional): Mail carbon-copy recipients.
+            subject (str, optional): Mail subject.
+            interval (int, float, optional): Minimum delay between two digests, in seconds.
+            idle_timeout (int, float, optional): Delay after which an unused SMTP connection is closed
+                (and a detached sender exits), in seconds.
+            max_signatures (int, optional): Maximum number of distinct errors listed in a digest.
+            spool (str, optional): Errors spool path (default to a path under `CACHE_DIR`, per mail configuration).
+            detached (bool, optional): Send the digests from a detached process (`True`) or from a thread of this process.
+        """
+        self.logger = logging.getLogger("soc.apiclient.itop.MailNotifier")
+        self.server = server
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.cc = cc
+        self.subject = subject
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.max_signatures = max_signatures
+        if spool is None:
+            from soc.apiclient.itop import CACHE_DIR
+            spool = spool_path(CACHE_DIR, server, port, sender, recipients, cc)
+        self.spool = ErrorSpool(spool)
+        self.detached = detached
+        self.smtp = None
+        self.thread = None
+        self.poll = 0.5
+
+    def notify(self, error):
+        """Spool an error and make sure a sender is running (never blocks on SMTP nor raises).
+
+        Arguments:
+            error (Exception, str): Error to notify.
+        """
+        try:
+            if self.spool.append(signature(error), str(error), time.time()) is False:
+                self.logger.warning("error notification dropped: spool '{0}' is full".format(self.spool.path))
+            if self.detached is False:
+                self.start()
+            elif self.running() is False:
+                self.spawn()
+        except Exception as failure:
+            self.logger.error("cannot spool error notification: {0}".format(str(failure)))
+
+    def close(self):
+        """Hand the spooled errors over to a detached sender if this process was sending them (never waits for SMTP).
+        """
+        if self.thread is not None and self.thread.is_alive() and self.spool.pending():
+            self.spawn()
+
+    def start(self):
+        """Start the sender thread (no-op if already started).
+        """
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name="MailNotifier", daemon=True)
+            self.thread.start()
+
+    def running(self):
+        """Return whether a sender currently holds the spool lock.
+        """
+        with open(self.spool.path + ".lock", 'a') as fd:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+        return False
+
+    def spawn(self):
+        """Start a detached sender process.
+        """
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + [p for p in [os.environ.get("PYTHONPATH")] if p]))
+        command = [sys.executable, "-m", "soc.apiclient.itop.notify", "--spool", self.spool.path,
+                   "--server", self.server, "--port", str(self.port), "--sender", self.sender, "--subject", self.subject,
+                   "--interval", str(self.interval), "--idle-timeout", str(self.idle_timeout),
+                   "--recipients"] + list(self.recipients) + ["--cc"] + list(self.cc)
+        self.logger.info("starting detached mail sender (spool='{0}')".format(self.spool.path))
+        with open(self.spool.path + ".log", 'a') as log:
+            subprocess.Popen(command, env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True, close_fds=True)
+
+    def last_sent(self):
+        try:
+            with open(self.spool.path + ".sent", 'r') as fd:
+                return float(fd.read().strip())
+        except Exception:
+            return 0.0
+
+    def run(self, exit_idle=False, lock_timeout=5.0):
+        """Sender loop: send the spooled errors digests, at most one per `interval` seconds.
+
+        Arguments:
+            exit_idle (bool, optional): Return once the spool stayed empty for `idle_timeout` seconds.
+            lock_timeout (int, float, optional): Maximum waiting time for the spool lock, in seconds
+                (another sender is running if it cannot be acquired).
+        """
+        while True:
+            with open(self.spool.path + ".lock", 'a') as lock:
+                deadline = time.monotonic() + lock_timeout
+                while True:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except OSError:
+                        if time.monotonic() >= deadline:
+                            self.logger.info("another mail sender is running")
+                            return
+                        time.sleep(0.2)
+                try:
+                    self.serve(exit_idle)
+                finally:
+                    self.disconnect()
+            # Errors spooled while exiting were left to this sender: serve them.
+            if not self.spool.pending():
+                return
+
+    def serve(self, exit_idle=False):
+        idle = time.monotonic()
+        while True:
+            if self.spool.pending():
+                idle = time.monotonic()
+                wait = self.last_sent() + self.interval - time.time()
+                if wait <= 0:
+                    digest = OrderedDict()
+                    for record in self.spool.drain():
+                        self.aggregate(digest, record["signature"], record["message"], record["timestamp"])
+                    if len(digest) > 0:
+                        self.send(digest)
+                        with open(self.spool.path + ".sent", 'w') as fd:
+                            fd.write(str(time.time()))
+                    continue
+                time.sleep(min(wait, self.poll))
+            elif time.monotonic() - idle >= self.idle_timeout:
+                self.disconnect()
+                if exit_idle is True:
+                    return
+                idle = time.monotonic()
+            else:
+                time.sleep(self.poll)
+
+    def aggregate(self, digest, sig, message, timestamp):
+        """Add an error to a digest, deduplicating it by signature.
+        """
+        if sig not in digest and len(digest) >= self.max_signatures:
+            sig = "(other errors)"
+        entry = digest.get(sig)
+        if entry is None:
+            entry = digest[sig] = {"count": 0, "first": timestamp, "last": timestamp, "message": message}
+        entry["count"] += 1
+        entry["last"] = timestamp
+
+    def render(self, digest):
+        """Return the subject and HTML payload of a digest.
+        """
+        fmt = lambda t: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+        total = sum([e["count"] for e in digest.values()])
+        rows = [DIGEST_ROW.format(count=e["count"], first=fmt(e["first"]), last=fmt(e["last"]), message=html.escape(e["message"])) for e in digest.values()]
+        payload = DIGEST_MAIL.format(total=total,
+                                     distinct=len(digest),
+                                     first=fmt(min([e["first"] for e in digest.values()])),
+                                     last=fmt(max([e["last"] for e in digest.values()])),
+                                     rows="\n            ".join(rows))
+        subject = total > 1 and "{0} ({1} errors)".format(self.subject, total) or self.subject
+        return subject, payload
+
+    def connect(self):
+        """Return the SMTP connection, opening it if needed.
+        """
+        import smtplib
+        if self.smtp is None:
+            self.logger.info("setting-up smtp client (host='{server}', port='{port}')".format(server=self.server, port=self.port))
+            self.smtp = smtplib.SMTP(host=self.server, port=self.port)
+        return self.smtp
+
+    def disconnect(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+            self.smtp = None
+
+    def send(self, digest):
+        """Send a digest, reconnecting once if the connection was closed by the server.
+        """
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        if len(self.recipients) == 0:
+            self.logger.warning("mail not sent: no recipients")
+            return
+        subject, payload = self.render(digest)
+        email = MIMEMultipart()
+        email["Subject"] = subject
+        email["from"] = self.sender
+        email["To"] = ", ".join(self.recipients)
+        email["CC"] = ", ".join(self.cc)
+        email.attach(MIMEText(payload, "html"))
+        for attempt in range(2):
+            try:
+                errors = self.connect().sendmail(self.sender, self.recipients + self.cc, email.as_string())
+            except Exception as error:
+                self.disconnect()
+                if attempt > 0:
+                    self.logger.error("error while sending mail: {0}".format(str(error)))
+                continue
+            if len(errors) > 0:
+                self.logger.error("error while sending mail: {errs}".format(errs=", ".join(errors)))
+            else:
+                self.logger.info("mail sent ({0} distinct error(s))".format(len(digest)))
+            return
+
+
+def main():
+    """Detached mail sender (see `MailNotifier.spawn`).
+    """
+    parser = argparse.ArgumentParser(description="soc.apiclient.itop errors mail sender")
+    parser.add_argument("--spool", type=str, required=True, help="Errors spool path")
+    parser.add_argument("--server", type=str, default="127.0.0.1", help="Mail server")
+    parser.add_argument("--port", type=int, default=25, help="Mail server port")
+    parser.add_argument("--sender", type=str, default="", help="Mail sender")
+    parser.add_argument("--subject", type=str, default="soc.apiclient.itop error", help="Mail subject")
+    parser.add_argument("--recipients", type=str, default=[], nargs='*', help="Mail recipients")
+    parser.add_argument("--cc", type=str, default=[], nargs='*', help="Mail carbon-copy recipients")
+    parser.add_argument("--interval", type=float, default=60.0, help="Minimum delay between two digests, in seconds")
+    parser.add_argument("--idle-timeout", type=float, dest="idle_timeout", default=30.0, help="Exit once idle for the given number of seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    notifier = MailNotifier(server=args.server, port=args.port, sender=args.sender, recipients=args.recipients, cc=args.cc,
+                            subject=args.subject, interval=args.interval, idle_timeout=args.idle_timeout, spool=args.spool)
+    notifier.run(exit_idle=True)
+
+
+if __name__ == "__main__":
+    main()
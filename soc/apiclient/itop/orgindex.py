@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import logging
+import threading
+
+
+class OrganizationIndex(object):
+    """Local organization index, mapping organizations codes, names and
+    friendly names to their ID.
+
+    The index is built from an `Organization` get action, persisted in an
+    on-disk snapshot and refreshed in the background, so that organization
+    selectors can be resolved to integer IDs before a request is sent. Unknown
+    selectors trigger a refetch (at most once per `min_refetch` seconds), to
+    resolve the organizations created since the index was built.
+    """
+
+    # Indexed attributes.
+    ATTRIBUTES = ["code", "name", "friendlyname"]
+
+    def __init__(self, action, snapshot=None, max_age=3600, refresh=600, min_refetch=30):
+        """Initialize the class instance.
+
+        Arguments:
+            action (object): `Organization` get action (`GetAction`).
+            snapshot (str, callable, optional): On-disk snapshot path, or a callable returning it
+                (called on first use, ex: once the iTop instance is known).
+            max_age (int, float, optional): Maximum age of a usable snapshot, in seconds.
+            refresh (int, float, optional): Background refresh interval, in seconds (`None` to disable).
+            min_refetch (int, float, optional): Minimum age of the index before an unknown selector triggers a refetch, in seconds.
+        """
+        self.logger = logging.getLogger("soc.apiclient.itop.OrganizationIndex")
+        self.action = action
+        self.snapshot = snapshot
+        self.max_age = max_age
+        self.refresh = refresh
+        self.min_refetch = min_refetch
+        self.maps = None
+        self.timestamp = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def build(self, organizations, timestamp):
+        """Replace the index content.
+
+        Arguments:
+            organizations (list of dict): Organizations (with 'id', 'code', 'name' and 'friendlyname').
+            timestamp (float): Organizations list timestamp.
+        """
+        maps = dict([(a, {}) for a in self.ATTRIBUTES])
+        for org in organizations:
+            for attr in self.ATTRIBUTES:
+                if org.get(attr):
+                    maps[attr][org[attr]] = int(org["id"])
+        self.maps, self.timestamp = maps, timestamp
+
+    def snapshot_path(self):
+        """Return the on-disk snapshot path (`None` if disabled).
+        """
+        if callable(self.snapshot):
+            self.snapshot = self.snapshot()
+        return self.snapshot
+
+    def fetch(self):
+        """Rebuild the index from iTop and save its snapshot.
+        """
+        self.logger.info("fetching organizations")
+        organizations = []
+        for obj in self.action.iter(output=["id"] + self.ATTRIBUTES, page_size=None):
+            org = dict([(a, obj["fields"].get(a)) for a in self.ATTRIBUTES])
+            org["id"] = obj["key"]
+            organizations.append(org)
+        self.build(organizations, time.time())
+        if self.snapshot_path() is not None:
+            try:
+                if not os.path.isdir(os.path.dirname(self.snapshot)):
+                    os.makedirs(os.path.dirname(self.snapshot))
+                with open(self.snapshot + ".tmp", 'w') as fd:
+                    json.dump({"timestamp": self.timestamp, "organizations": organizations}, fd)
+                os.replace(self.snapshot + ".tmp", self.snapshot)
+            except Exception as error:
+                self.logger.warning("cannot save organizations snapshot to '{0}': {1}".format(self.snapshot, str(error)))
+
+    def load(self):
+        """Load the index from its snapshot if it is recent enough, from iTop otherwise.
+        """
+        if self.snapshot_path() is not None and os.path.isfile(self.snapshot):
+            try:
+                with open(self.snapshot, 'r') as fd:
+                    content = json.load(fd)
+                if time.time() - content["timestamp"] < self.max_age:
+                    self.logger.info("loading organizations from snapshot '{0}'".format(self.snapshot))
+                    self.build(content["organizations"], content["timestamp"])
+                    return
+            except Exception as error:
+                self.logger.warning("cannot load organizations snapshot from '{0}': {1}".format(self.snapshot, str(error)))
+        self.fetch()
+
+    def start(self):
+        """Start the background refresh thread (no-op if already started or disabled).
+        """
+        if self.refresh is None or self.thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.refresh)
+                try:
+                    self.fetch()
+                except Exception as error:
+                    self.logger.error("cannot refresh organizations: {0}".format(str(error)))
+
+        self.thread = threading.Thread(target=run, name="OrganizationIndex")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def resolve(self, attribute, value):
+        """Resolve an organization selector to its ID.
+
+        Arguments:
+            attribute (str): Selector attribute ('code', 'name' or 'friendlyname').
+            value (str): Selector value.
+        """
+        if attribute not in self.ATTRIBUTES:
+            raise Exception("Unsupported organization selector: '{0}' (expected one of {1})".format(attribute, ", ".join(self.ATTRIBUTES)))
+        with self.lock:
+            if self.maps is None:
+                self.load()
+                self.start()
+            org_id = self.maps[attribute].get(value)
+            if org_id is None and time.time() - self.timestamp >= self.min_refetch:
+                self.logger.info("unknown organization {0}='{1}', refetching organizations".format(attribute, value))
+                self.fetch()
+                org_id = self.maps[attribute].get(value)
+        if org_id is None:
+            raise Exception("Unknown organization: {0}='{1}' (index from {2})".format(attribute, value, time.ctime(self.timestamp)))
+        return org_id
@@ -0,0 +1,161 @@
+import sys
+import csv
+import json
+from collections import OrderedDict
+from soc.apiclient.itop.results import ResultSet
+
+
+# Supported output formats.
+FORMATS = ["table", "json", "ndjson", "csv"]
+
+
+class Writer(object):
+    """Base output writer: objects are written one by one, as soon as they are available.
+    """
+
+    def __init__(self, stream=None, columns=None, headers=None, key=True):
+        """Initialize the class instance.
+
+        Arguments:
+            stream (object, optional): Output stream (default to `sys.stdout`).
+            columns (list of str, optional): Written fields (default to all the fields).
+            headers (list of str, optional): Columns headers ('table' format, 'csv' uses the fields names).
+            key (bool, optional): Write the objects keys ('table' and 'csv' formats).
+        """
+        self.stream = stream is not None and stream or sys.stdout
+        self.columns = columns
+        self.headers = headers
+        self.key = key
+        self.count = 0
+
+    def project(self, obj):
+        """Return an object restricted to the writer columns.
+        """
+        if self.columns is None:
+            return obj
+        fields = obj.get("fields") or {}
+        obj = dict(obj)
+        obj["fields"] = OrderedDict([(c, fields.get(c)) for c in self.columns])
+        return obj
+
+    def write(self, obj):
+        self.count += 1
+
+    def close(self):
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        # An interrupted output is not terminated (ex: no JSON document end).
+        if error_type is None:
+            self.close()
+        else:
+            self.stream.flush()
+
+
+class TableWriter(Writer):
+    """Text table writer (needs all the objects to size the columns: only the
+    displayed fields are kept, see `results.ResultSet`).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TableWriter, self).__init__(*args, **kwargs)
+        self.results = ResultSet(self.columns)
+
+    def write(self, obj):
+        super(TableWriter, self).write(obj)
+        self.results.append(obj)
+
+    def close(self):
+        self.stream.write(self.results.to_table(headers=self.headers, key=self.key) + "\n")
+        super(TableWriter, self).close()
+
+
+class JsonWriter(Writer):
+    """JSON writer, producing a `core/get`-like document.
+    """
+
+    def write(self, obj):
+        obj = self.project(obj)
+        self.stream.write(self.count == 0 and '{\n  "objects": {\n' or ',\n')
+        super(JsonWriter, self).write(obj)
+        self.stream.write("    {0}: {1}".format(json.dumps("{0}::{1}".format(obj.get("class"), obj.get("key"))), json.dumps(obj)))
+
+    def close(self):
+        if self.count == 0:
+            self.stream.write('{\n  "objects": null')
+        else:
+            self.stream.write("\n  }")
+        self.stream.write(',\n  "code": 0,\n  "message": "Found: {0}"\n}}\n'.format(self.count))
+        super(JsonWriter, self).close()
+
+
+class NdjsonWriter(Writer):
+    """Newline-delimited JSON writer (one object per line, flushed).
+    """
+
+    def write(self, obj):
+        super(NdjsonWriter, self).write(obj)
+        self.stream.write(json.dumps(self.project(obj)) + "\n")
+        self.stream.flush()
+
+
+class CsvWriter(Writer):
+    """CSV writer (columns default to the fields of the first object).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CsvWriter, self).__init__(*args, **kwargs)
+        self.writer = csv.writer(self.stream)
+
+    def write(self, obj):
+        fields = obj.get("fields") or {}
+        if self.count == 0:
+            if self.columns is None:
+                self.columns = list(fields.keys())
+            self.writer.writerow((self.key is True and ["key"] or []) + list(self.columns))
+        super(CsvWriter, self).write(obj)
+        values = [fields.get(c) for c in self.columns]
+        values = [isinstance(v, (dict, list)) and json.dumps(v) or v for v in values]
+        self.writer.writerow((self.key is True and [obj.get("key")] or []) + values)
+
+
+WRITERS = {
+    "table": TableWriter,
+    "json": JsonWriter,
+    "ndjson": NdjsonWriter,
+    "csv": CsvWriter,
+}
+
+
+def get_writer(fmt, stream=None, columns=None, headers=None, key=True):
+    """Return an output writer.
+
+    Arguments:
+        fmt (str): Output format ('table', 'json', 'ndjson' or 'csv').
+        stream (object, optional): Output stream (default to `sys.stdout`).
+        columns (list of str, optional): Written fields (default to all the fields).
+        headers (list of str, optional): Columns headers ('table' format, 'csv' uses the fields names).
+        key (bool, optional): Write the objects keys ('table' and 'csv' formats).
+    """
+    if fmt not in WRITERS:
+        raise Exception("Unsupported output format: '{0}' (expected one of {1})".format(fmt, ", ".join(FORMATS)))
+    return WRITERS[fmt](stream=stream, columns=columns, headers=headers, key=key)
+
+
+def write_objects(objects, fmt, **kwargs):
+    """Write iTop objects as soon as they are iterated.
+
+    Arguments:
+        objects (iterable of dict): iTop objects (ex: `GetAction.iter()`).
+        fmt (str): Output format (see `get_writer`).
+        kwargs (optional): Writer arguments.
+
+    Returns the number of written objects.
+    """
+    with get_writer(fmt, **kwargs) as writer:
+        for obj in objects:
+            writer.write(obj)
+    return writer.count
@@ -0,0 +1,72 @@
+import re
+import hashlib
+from html import unescape
+
+
+# Fragments boundaries: line breaks and closing HTML block tags.
+BOUNDARIES = re.compile(r"(\r?\n|<br\s*/?>|</p>|</div>|</li>|</tr>)", re.IGNORECASE)
+
+# HTML tags and whitespaces (normalization).
+TAGS = re.compile(r"<[^>]*>")
+SPACES = re.compile(r"\s+")
+
+
+def normalize(fragment):
+    """Normalize a text fragment: strip HTML tags, unescape entities and collapse whitespaces.
+    """
+    return SPACES.sub(" ", unescape(TAGS.sub(" ", fragment))).strip()
+
+
+def fragments(text):
+    """Split a text into `(fragment, boundary)` tuples (line or HTML block granularity).
+    """
+    parts = BOUNDARIES.split(text)
+    # `split` with a capturing group alternates fragments and boundaries.
+    parts.append("")
+    return list(zip(parts[0::2], parts[1::2]))
+
+
+def digest(normalized):
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+
+
+class PublogIndex(object):
+    """Hashed index of the normalized fragments of an incident public log.
+
+    Used to strip already-posted content from a new public log text in linear
+    time, whatever the HTML formatting of the existing entries.
+    """
+
+    def __init__(self, entries=[]):
+        """Initialize the class instance.
+
+        Arguments:
+            entries (list of dict, optional): iTop public log entries (with 'message' and/or 'message_html').
+        """
+        self.digests = set()
+        for entry in entries:
+            for attr in ["message", "message_html"]:
+                if entry.get(attr):
+                    self.add(entry[attr])
+
+    def add(self, text):
+        """Index the fragments of a text.
+        """
+        for fragment, _ in fragments(text):
+            normalized = normalize(fragment)
+            if len(normalized) > 0:
+                self.digests.add(digest(normalized))
+
+    def strip(self, text):
+        """Return the text without its already-indexed fragments (empty string if nothing is left).
+        """
+        kept = []
+        for fragment, boundary in fragments(text):
+            normalized = normalize(fragment)
+            if len(normalized) > 0 and digest(normalized) in self.digests:
+                continue
+            kept.append(fragment + boundary)
+        result = "".join(kept)
+        if len(normalize(result)) == 0:
+            return ""
+        return result.strip()
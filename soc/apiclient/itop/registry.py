@@ -0,0 +1,132 @@
+import os
+import json
+import glob
+import logging
+try:
+    import importlib.machinery
+except Exception:
+    pass
+from soc.apiclient.itop import LOADED_FACTORIES, CACHE_DIR
+
+
+logger = logging.getLogger("soc.apiclient.itop.registry")
+
+# Factories location.
+FACTORIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "factories")
+
+# Cached factories manifest location.
+MANIFEST_PATH = os.path.join(CACHE_DIR, "factories.json")
+
+# Manifest format version.
+MANIFEST_VERSION = 1
+
+
+class ParserRecorder(object):
+    """Sub-parsers container proxy recording the commands added by a factory.
+    """
+
+    def __init__(self, sp):
+        self.sp = sp
+        self.commands = []
+
+    def add_parser(self, name, **kwargs):
+        self.commands.append({"name": name, "help": kwargs.get("help", None)})
+        return self.sp.add_parser(name, **kwargs)
+
+
+def factory_paths():
+    """Return the available factories as a `{name: path}` mapping.
+    """
+    paths = {}
+    for factory_path in sorted(glob.glob(os.path.join(FACTORIES_PATH, "*.py"))):
+        factory_name = os.path.basename(factory_path).split(".py")[0]
+        if factory_name not in ["__init__", ]:
+            paths[factory_name] = factory_path
+    return paths
+
+
+def load_factory(name):
+    """Load a factory (no-op if already loaded) and return its module.
+
+    Arguments:
+        name (str): Factory name (ex: 'incident_siem').
+    """
+    if name in LOADED_FACTORIES:
+        return LOADED_FACTORIES[name]
+    factory_path = os.path.join(FACTORIES_PATH, "{0}.py".format(name))
+    if name == "__init__" or not os.path.isfile(factory_path):
+        raise Exception("Invalid factory: '{0}'".format(name))
+    logger.info("loading factory '{0}' from '{1}'".format(name, factory_path))
+    try:
+        LOADED_FACTORIES[name] = importlib.machinery.SourceFileLoader("factories.{0}".format(name), factory_path).load_module()
+    except Exception:
+        LOADED_FACTORIES[name] = __import__("soc.apiclient.itop.factories.{0}".format(name), fromlist=["soc.apiclient.itop.factories"])
+    return LOADED_FACTORIES[name]
+
+
+def load_factories():
+    """Load all available factories at once.
+    """
+    logger.info("locating all factories from '{0}'".format(FACTORIES_PATH))
+    for name in factory_paths():
+        load_factory(name)
+
+
+def signature(paths):
+    """Return the factories files signature (used to invalidate the manifest).
+    """
+    signature = {}
+    for name, path in paths.items():
+        stat = os.stat(path)
+        signature[name] = [stat.st_mtime, stat.st_size]
+    return signature
+
+
+def build_manifest(paths):
+    """Load all the factories and list the commands they provide.
+    """
+    import argparse
+    manifest = {"version": MANIFEST_VERSION, "signature": signature(paths), "factories": {}}
+    for name in paths:
+        factory = load_factory(name)
+        recorder = ParserRecorder(argparse.ArgumentParser().add_subparsers())
+        if getattr(factory, "add_parser", None) is not None:
+            factory.add_parser(recorder)
+        manifest["factories"][name] = recorder.commands
+    return manifest
+
+
+def get_manifest():
+    """Return the factories manifest, from cache if up to date.
+
+    The manifest is a `dict` listing, for each factory, the commands it provides
+    (`{"factories": {name: [{"name": command, "help": help}, ...]}}`).
+    """
+    paths = factory_paths()
+    try:
+        with open(MANIFEST_PATH, 'r') as fd:
+            manifest = json.load(fd)
+        if manifest.get("version") == MANIFEST_VERSION and manifest.get("signature") == json.loads(json.dumps(signature(paths))):
+            return manifest
+    except Exception:
+        pass
+    logger.info("building factories manifest")
+    manifest = build_manifest(paths)
+    try:
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        with open(MANIFEST_PATH + ".tmp", 'w') as fd:
+            json.dump(manifest, fd)
+        os.replace(MANIFEST_PATH + ".tmp", MANIFEST_PATH)
+    except Exception as error:
+        logger.warning("cannot save factories manifest to '{0}': {1}".format(MANIFEST_PATH, str(error)))
+    return manifest
+
+
+def command_factory(manifest, command):
+    """Return the name of the factory providing a command (`None` if not found).
+    """
+    for name, commands in manifest["factories"].items():
+        if command in [c["name"] for c in commands]:
+            return name
+    return None
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+
+
+class ObjectRecord(object):
+    """Compact iTop object: its fields values are stored in a tuple, aligned on
+    the columns shared by all the records of a `ResultSet`.
+    """
+
+    __slots__ = ["iclass", "key", "columns", "values"]
+
+    def __init__(self, iclass, key, columns, values):
+        """Initialize the class instance.
+
+        Arguments:
+            iclass (str): iTop object class name.
+            key (str): iTop object key.
+            columns (tuple of str): Fields names (shared between records).
+            values (tuple): Fields values.
+        """
+        self.iclass = iclass
+        self.key = key
+        self.columns = columns
+        self.values = values
+
+    def __getitem__(self, name):
+        return self.values[self.columns.index(name)]
+
+    def get(self, name, default=None):
+        if name in self.columns:
+            return self.values[self.columns.index(name)]
+        return default
+
+    @property
+    def fields(self):
+        """Fields as a `dict` (built on each access).
+        """
+        return OrderedDict(zip(self.columns, self.values))
+
+    def as_dict(self):
+        """Return the object as returned by iTop.
+        """
+        return {"code": 0, "message": "", "class": self.iclass, "key": self.key, "fields": self.fields}
+
+    def __repr__(self):
+        return "<ObjectRecord {0}::{1}>".format(self.iclass, self.key)
+
+
+class ResultSet(object):
+    """Compact `core/get` results: a list of `ObjectRecord` sharing the same columns.
+    """
+
+    def __init__(self, columns=None):
+        """Initialize the class instance.
+
+        Arguments:
+            columns (list of str, optional): Kept fields (default to the fields of the first added object).
+        """
+        self.columns = columns is not None and tuple(columns) or None
+        self.records = []
+
+    @classmethod
+    def from_objects(cls, objects, columns=None):
+        """Build a result set from iTop objects (ex: `GetAction.iter()` or `Mirror.iter()`).
+
+        Arguments:
+            objects (iterable of dict): iTop objects.
+            columns (list of str, optional): Kept fields.
+        """
+        results = cls(columns)
+        for obj in objects:
+            results.append(obj)
+        return results
+
+    @classmethod
+    def from_response(cls, response, columns=None):
+        """Build a result set from a `core/get` response.
+
+        Arguments:
+            response (dict): iTop response.
+            columns (list of str, optional): Kept fields.
+        """
+        if response.get("code", 0) != 0:
+            raise Exception("iTop error (code={0}): {1}".format(response.get("code"), response.get("message")))
+        return cls.from_objects((response.get("objects") or {}).values(), columns)
+
+    def append(self, obj):
+        """Add an iTop object (`dict` with 'class', 'key' and 'fields').
+        """
+        fields = obj.get("fields") or {}
+        if self.columns is None:
+            self.columns = tuple(fields.keys())
+        self.records.append(ObjectRecord(obj.get("class"), obj.get("key"), self.columns, tuple([fields.get(c) for c in self.columns])))
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    def column(self, name):
+        """Return the values of a field (or of 'key'), as a `list`.
+        """
+        if name == "key":
+            return [r.key for r in self.records]
+        index = self.columns.index(name)
+        return [r.values[index] for r in self.records]
+
+    def columnar(self, columns=None):
+        """Return a columnar view of the results (field name to `list` of values, including 'key').
+
+        Arguments:
+            columns (list of str, optional): Fields (default to all the fields).
+        """
+        columns = columns is not None and columns or ["key"] + list(self.columns or [])
+        return OrderedDict([(c, self.column(c)) for c in columns])
+
+    def to_rows(self, columns=None, key=False):
+        """Return the results as rows (`list` of `list`), for `tabulate` or `csv`.
+
+        Arguments:
+            columns (list of str, optional): Fields (default to all the fields).
+            key (bool, optional): Prepend the objects keys.
+        """
+        indexes = [self.columns.index(c) for c in (columns is not None and columns or self.columns or [])]
+        if key is True:
+            return [[r.key] + [r.values[i] for i in indexes] for r in self.records]
+        return [[r.values[i] for i in indexes] for r in self.records]
+
+    def to_table(self, columns=None, headers=None, key=False):
+        """Return the results as a `tabulate` text table.
+
+        Arguments:
+            columns (list of str, optional): Fields (default to all the fields).
+            headers (list of str, optional): Table headers (default to the fields names).
+            key (bool, optional): Prepend the objects keys.
+        """
+        from tabulate import tabulate
+        if headers is None:
+            headers = (key is True and ["key"] or []) + list(columns is not None and columns or self.columns or [])
+        return tabulate(self.to_rows(columns, key), headers=headers)
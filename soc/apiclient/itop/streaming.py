@@ -0,0 +1,108 @@
+import json
+import codecs
+
+
+class ObjectStream(object):
+    """Incrementally decode an iTop JSON response.
+
+    The entries of the top-level `objects` map are yielded as `(name, object)`
+    tuples (ex: `("Incident::42", {...})`) as soon as they are decoded, so that
+    only one object at a time is held in memory. The other top-level members
+    (ex: `code` and `message`) are stored in `header`.
+    """
+
+    def __init__(self, chunks, encoding="utf-8"):
+        """Initialize the class instance.
+
+        Arguments:
+            chunks (iterable of bytes): Response body chunks.
+            encoding (str, optional): Response body encoding.
+        """
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.header = {}
+
+    def fill(self):
+        """Append the next chunk to the buffer. Returns `False` once the stream is exhausted.
+        """
+        if self.eof:
+            return False
+        # Drop consumed data.
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        try:
+            self.buffer += self.decoder.decode(next(self.chunks))
+        except StopIteration:
+            self.buffer += self.decoder.decode(b"", final=True)
+            self.eof = True
+        return True
+
+    def peek(self):
+        """Skip whitespaces and return the next character (`None` at end of stream).
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of `chars`.
+        """
+        c = self.peek()
+        if c is None or c not in chars:
+            raise Exception("Invalid iTop response: expected one of '{0}' at offset {1}, got '{2}'".format(chars, self.pos, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode the next complete JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+                # A value ending with the buffer may be truncated (ex: numbers).
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def objects(self):
+        """Yield the entries of the `objects` map (the opening brace being already consumed).
+        """
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            name = self.value()
+            self.expect(':')
+            yield name, self.value()
+            if self.expect(",}") == '}':
+                return
+
+    def __iter__(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            name = self.value()
+            self.expect(':')
+            if name == "objects" and self.peek() == '{':
+                self.pos += 1
+                for entry in self.objects():
+                    yield entry
+            else:
+                self.header[name] = self.value()
+            if self.expect(",}") == '}':
+                return
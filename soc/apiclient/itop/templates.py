@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import jinja2
+import jinja2.meta
+
+
+class PathLoader(jinja2.BaseLoader):
+    """Jinja2 loader for templates referenced by their file system path.
+    """
+
+    def get_source(self, environment, template):
+        path = os.path.abspath(template)
+        if not os.path.isfile(path):
+            raise jinja2.TemplateNotFound(template)
+        mtime = os.path.getmtime(path)
+        with open(path, 'r') as fd:
+            source = fd.read()
+        return source, path, lambda: os.path.isfile(path) and os.path.getmtime(path) == mtime
+
+
+class TemplateCache(object):
+    """Compiled templates cache.
+
+    Templates are compiled once per version (path and modification time) and
+    their compiled bytecode is persisted on disk, along with the set of
+    variables they use, so that new processes skip both parsing and compiling.
+    """
+
+    def __init__(self, directory=None):
+        """Initialize the class instance.
+
+        Arguments:
+            directory (str, optional): Persistent cache directory (no persistent cache if `None`).
+        """
+        self.logger = logging.getLogger("soc.apiclient.itop.TemplateCache")
+        self.directory = directory
+        bytecode_cache = None
+        if directory is not None:
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(directory)
+            except Exception as error:
+                self.logger.warning("cannot use template cache directory '{0}': {1}".format(directory, str(error)))
+                self.directory = None
+        self.environment = jinja2.Environment(loader=PathLoader(), bytecode_cache=bytecode_cache, auto_reload=True)
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def variables(self, path, mtime):
+        """Return the variables used by a template version, from the persistent cache if available.
+        """
+        meta_path = None
+        if self.directory is not None:
+            meta_path = os.path.join(self.directory, "{0}.vars.json".format(hashlib.sha1(path.encode("utf-8")).hexdigest()))
+            try:
+                with open(meta_path, 'r') as fd:
+                    meta = json.load(fd)
+                if meta["mtime"] == mtime:
+                    return frozenset(meta["variables"])
+            except Exception:
+                pass
+        source, _, _ = self.environment.loader.get_source(self.environment, path)
+        variables = frozenset(jinja2.meta.find_undeclared_variables(self.environment.parse(source)))
+        if meta_path is not None:
+            try:
+                with open(meta_path, 'w') as fd:
+                    json.dump({"mtime": mtime, "variables": sorted(variables)}, fd)
+            except Exception as error:
+                self.logger.warning("cannot save template variables to '{0}': {1}".format(meta_path, str(error)))
+        return variables
+
+    def get(self, template):
+        """Return a template and the set of variables it uses.
+
+        Arguments:
+            template (str): Template path.
+        """
+        path = os.path.abspath(template)
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            entry = self.templates.get(path)
+            if entry is None or entry[0] != mtime:
+                self.logger.info("compiling template '{0}'".format(path))
+                entry = (mtime, self.environment.get_template(path), self.variables(path, mtime))
+                self.templates[path] = entry
+        return entry[1], entry[2]
+
+
+# Shared templates cache (see `get_template_cache`).
+TEMPLATE_CACHE = None
+
+
+def get_template_cache():
+    """Return the shared templates cache.
+    """
+    global TEMPLATE_CACHE
+    if TEMPLATE_CACHE is None:
+        from soc.apiclient.itop import CACHE_DIR
+        TEMPLATE_CACHE = TemplateCache(os.path.join(CACHE_DIR, "jinja2"))
+    return TEMPLATE_CACHE
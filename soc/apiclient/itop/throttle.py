@@ -0,0 +1,169 @@
+import time
+import random
+import logging
+import threading
+
+
+# Operations which may be safely retried.
+IDEMPOTENT_OPERATIONS = ["core/get", "list_operations"]
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket (requests rate ceiling).
+    """
+
+    def __init__(self, rate, burst=None):
+        """Initialize the class instance.
+
+        Arguments:
+            rate (float): Tokens refill rate, in tokens per second.
+            burst (float, optional): Bucket capacity (default to `rate`).
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst is not None and burst or max(1.0, rate))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for the bucket to refill if needed.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter(object):
+    """Adaptive concurrency limiter.
+
+    The number of allowed in-flight requests is adjusted AIMD-style: it grows
+    additively (by `1 / limit` per successful request faster than the target
+    latency) and shrinks multiplicatively on errors and slow requests. An
+    optional token bucket sets a ceiling on the requests rate, and failed
+    idempotent requests are retried with a jittered exponential backoff.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, target_latency=1.0, backoff=0.5, rate=None, burst=None, retries=3, retry_delay=0.5):
+        """Initialize the class instance.
+
+        Arguments:
+            initial (int, optional): Initial concurrency limit.
+            minimum (int, optional): Minimum concurrency limit.
+            maximum (int, optional): Maximum concurrency limit.
+            target_latency (float, optional): Latency above which the limit is decreased, in seconds.
+            backoff (float, optional): Multiplicative decrease factor.
+            rate (float, optional): Maximum requests rate, in requests per second (no ceiling if `None`).
+            burst (float, optional): Maximum requests burst (default to `rate`).
+            retries (int, optional): Maximum number of retries for idempotent requests.
+            retry_delay (float, optional): Base retry delay, in seconds (doubled on each retry, fully jittered).
+        """
+        self.logger = logging.getLogger("soc.apiclient.itop.AdaptiveLimiter")
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.bucket = rate is not None and TokenBucket(rate, burst) or None
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.inflight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a request slot.
+        """
+        if self.bucket is not None:
+            self.bucket.acquire()
+        with self.condition:
+            while self.inflight >= max(self.minimum, int(self.limit)):
+                self.condition.wait()
+            self.inflight += 1
+
+    def release(self, latency, failed):
+        """Release a request slot and adjust the concurrency limit.
+
+        Arguments:
+            latency (float): Request latency, in seconds.
+            failed (bool): Whether the request failed.
+        """
+        with self.condition:
+            self.inflight -= 1
+            if failed or latency > self.target_latency:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.logger.info("decreasing concurrency limit to {0:.2f} (latency={1:.3f}s, failed={2})".format(self.limit, latency, failed))
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+    def retry_delay_of(self, error, attempt, idempotent):
+        """Return the delay before retrying a failed request, or `None` if it may not be retried.
+
+        Arguments:
+            error (Exception): Request error.
+            attempt (int): Number of retries already done.
+            idempotent (bool): Whether the request may be retried.
+        """
+        if not idempotent or attempt >= self.retries:
+            return None
+        delay = random.uniform(0, self.retry_delay * (2 ** attempt))
+        self.logger.warning("request failed ({0}), retrying in {1:.2f}s (attempt {2}/{3})".format(str(error), delay, attempt + 1, self.retries))
+        return delay
+
+    def run(self, func, idempotent=False):
+        """Run a request within the limiter.
+
+        Arguments:
+            func (callable): Request function.
+            idempotent (bool, optional): Whether the request may be retried.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            start = time.monotonic()
+            try:
+                result = func()
+            except Exception as error:
+                self.release(time.monotonic() - start, True)
+                delay = self.retry_delay_of(error, attempt, idempotent)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+            else:
+                self.release(time.monotonic() - start, False)
+                return result
+
+    async def run_async(self, func, idempotent=False):
+        """Run a request within the limiter, from an asyncio event loop.
+
+        The request slots are waited for in the loop default executor, so that
+        the limiter may be shared by threads and asyncio tasks.
+
+        Arguments:
+            func (callable): Request coroutine function.
+            idempotent (bool, optional): Whether the request may be retried.
+        """
+        import asyncio
+        attempt = 0
+        while True:
+            await asyncio.get_running_loop().run_in_executor(None, self.acquire)
+            start = time.monotonic()
+            try:
+                result = await func()
+            except Exception as error:
+                self.release(time.monotonic() - start, True)
+                delay = self.retry_delay_of(error, attempt, idempotent)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+            else:
+                self.release(time.monotonic() - start, False)
+                return result
@@ -0,0 +1,113 @@
+import json
+import time
+import logging
+from soc.apiclient.itop.mirror import get_mirror
+
+
+def classify(previous, current, status="status", hwm="last_update"):
+    """Return the change event type of an object, or `None` if it did not change.
+
+    Arguments:
+        previous (dict, optional): Previous object version (`None` if unknown).
+        current (dict): Current object version.
+        status (str, optional): Status field.
+        hwm (str, optional): Last update field.
+    """
+    if previous is None:
+        return "created"
+    elif previous["fields"].get(status) != current["fields"].get(status):
+        return "status-changed"
+    elif previous["fields"] != current["fields"] or previous["fields"].get(hwm) != current["fields"].get(hwm):
+        return "updated"
+    return None
+
+
+def load_state(mirror, name, iclass):
+    """Return the cursor (high-water mark) of a watcher, or `None` if it never polled the class.
+    """
+    db = mirror.connect()
+    db.execute("CREATE TABLE IF NOT EXISTS watch_cursor (watcher TEXT, class TEXT, hwm TEXT, PRIMARY KEY (watcher, class))")
+    db.execute("CREATE TABLE IF NOT EXISTS watch_state (watcher TEXT, class TEXT, id INTEGER, fields TEXT, PRIMARY KEY (watcher, class, id))")
+    row = db.execute("SELECT hwm FROM watch_cursor WHERE watcher = ? AND class = ?", (name, iclass)).fetchone()
+    return row is not None and row[0] or None
+
+
+def poll(mirror, name, iclass, status="status"):
+    """Compare the mirrored objects updated since the watcher cursor with the versions seen by the watcher.
+
+    Arguments:
+        mirror (object): Mirror instance, synced beforehand.
+        name (str): Watcher name.
+        iclass (str): Mirrored iTop object class name.
+        status (str, optional): Status field.
+
+    Returns the list of events (empty on the first poll, which records a silent baseline).
+    """
+    hwm = mirror.spec(iclass)["hwm"]
+    events = []
+    with mirror.lock:
+        cursor = load_state(mirror, name, iclass)
+        db = mirror.connect()
+        query, params = "SELECT data FROM {0}".format(mirror.table(iclass)), []
+        if cursor is not None:
+            query, params = query + ' WHERE "{0}" >= ?'.format(hwm), [cursor]
+        rows = db.execute(query, params).fetchall()
+        db.execute("BEGIN")
+        try:
+            for row in rows:
+                current = json.loads(row[0])
+                seen = db.execute("SELECT fields FROM watch_state WHERE watcher = ? AND class = ? AND id = ?", (name, iclass, int(current["key"]))).fetchone()
+                if cursor is not None:
+                    previous = seen is not None and {"fields": json.loads(seen[0])} or None
+                    event = classify(previous, current, status, hwm)
+                    if event is not None:
+                        events.append({"event": event, "class": iclass, "key": current["key"], "fields": current["fields"]})
+                        if event == "status-changed":
+                            events[-1]["previous_status"] = previous["fields"].get(status)
+                db.execute("INSERT OR REPLACE INTO watch_state (watcher, class, id, fields) VALUES (?, ?, ?, ?)", (name, iclass, int(current["key"]), json.dumps(current["fields"])))
+            cursor = db.execute('SELECT MAX("{0}") FROM {1}'.format(hwm, mirror.table(iclass))).fetchone()[0] or cursor or ""
+            db.execute("INSERT OR REPLACE INTO watch_cursor (watcher, class, hwm) VALUES (?, ?, ?)", (name, iclass, cursor))
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+    return events
+
+
+def watch(iclass, mirror=None, interval=30.0, status="status", cycles=None, name="default"):
+    """Poll a mirrored class and yield its changes.
+
+    Each poll is an incremental mirror sync (see `Mirror.sync`) followed by the comparison
+    of the mirrored objects updated since the watcher cursor with the versions last seen by
+    the watcher. The cursor and the seen versions are persisted in the mirror database, per
+    watcher: syncs run by others (ex: `core-sync`) between two polls do not hide changes.
+    The first poll of a watcher takes a silent baseline snapshot.
+
+    Arguments:
+        iclass (str): Mirrored iTop object class name (ex: 'Incident').
+        mirror (object, optional): Mirror instance (default to `get_mirror()`).
+        interval (int, float, optional): Delay between two polls, in seconds.
+        status (str, optional): Status field (changes are reported as 'status-changed' events).
+        cycles (int, optional): Number of polls (`None` to poll forever).
+        name (str, optional): Watcher name (each watcher has its own cursor).
+
+    Yields the events as `dict` with 'event' ('created', 'updated' or 'status-changed'),
+    'class', 'key', 'fields' and, for status changes, 'previous_status'.
+    """
+    logger = logging.getLogger("soc.apiclient.itop.watch")
+    mirror = mirror is not None and mirror or get_mirror()
+    if mirror.spec(iclass)["hwm"] is None:
+        raise Exception("Class '{0}' cannot be watched (no high-water mark field)".format(iclass))
+    cycle = 0
+    while cycles is None or cycle < cycles:
+        if cycle > 0:
+            time.sleep(interval)
+        cycle += 1
+        with mirror.lock:
+            baseline = load_state(mirror, name, iclass) is None
+            mirror.sync(iclass)
+            events = poll(mirror, name, iclass, status)
+        if baseline is True:
+            logger.info("baseline snapshot of class '{0}' taken by watcher '{1}'".format(iclass, name))
+        for event in events:
+            yield event
@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import socket
+import tempfile
+
+
+# Default daemon socket path.
+DEFAULT_SOCKET = os.environ.get("SOC_APICLIENT_ITOP_SOCKET", os.path.join(tempfile.gettempdir(), "soc_apiclient_itop.sock"))
+
+
+def forward(argv, path=DEFAULT_SOCKET):
+    """Forward a command line to a running `daemon-serve` instance.
+
+    Arguments:
+        argv (list of str): Command line arguments (same as `soc.apiclient.itop`).
+        path (str, optional): Daemon Unix socket path.
+
+    The command runs from the caller's working directory; the standard input
+    is not forwarded (commands reading it fail).
+
+    Returns the command response (`dict` with 'code', 'stdout' and 'stderr').
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        client.sendall(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode("utf-8") + b"\n")
+        client.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        client.close()
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+
+def main():
+    """Thin CLI client: `soc.apiclient.itop-client [--socket <path>] <command> [command arguments]`.
+
+    This module lives outside of the `soc` namespace package and only imports the
+    standard library, so that it starts fast: the heavy lifting is done by the daemon.
+    """
+    argv = sys.argv[1:]
+    path = DEFAULT_SOCKET
+    if len(argv) > 1 and argv[0] == "--socket":
+        path, argv = argv[1], argv[2:]
+    try:
+        response = forward(argv, path)
+    except (OSError, ValueError) as error:
+        sys.stderr.write("cannot reach daemon on '{0}': {1}\n".format(path, str(error)))
+        return 2
+    sys.stdout.write(response.get("stdout", ""))
+    sys.stderr.write(response.get("stderr", ""))
+    return response.get("code", 1)
+
+
+if __name__ == "__main__":
+    sys.exit(main())